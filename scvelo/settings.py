@@ -56,6 +56,14 @@ n_jobs = 1
 """Default number of jobs/ CPUs to use for parallel computing.
 """
 
+fit_dtype = "float32"
+"""Data type in which the time assignment layers of the dynamical model fit,
+e.g. 'fit_t', are stored (default 'float32'). This only affects storage: the
+fit, the smoothing and the alignment of the times run in float64, and the times
+are converted once done. Set to 'float64' for full precision, in which case
+refits write to the layers in place.
+"""
+
 logfile = ""
 """Name of logfile. By default is set to '' and writes to standard output."""
 
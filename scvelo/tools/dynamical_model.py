@@ -1,14 +1,18 @@
 from .. import settings
 from .. import logging as logg
 from ..preprocessing.moments import get_connectivities
-from .utils import make_unique_list, test_bimodality
+from .utils import make_dense, make_unique_list, test_bimodality
 from .dynamical_model_utils import BaseDynamics, linreg, convolve, tau_inv, unspliced
+from .dynamical_model_utils import compute_weights, percentile, masked_sum
+from .dynamical_model_utils import masked_mean, masked_std, align_reductions
+from .dynamical_model_utils import get_cluster_masks, scale_columns
 
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as pl
 from matplotlib import rcParams
-from scipy.optimize import minimize
+from scipy.optimize import OptimizeResult, least_squares, minimize, minimize_scalar
+from scipy.sparse import csc_matrix, csr_matrix, issparse
 import multiprocessing
 import ctypes
 from typing import Callable, Sequence, Tuple
@@ -16,43 +20,34 @@ from abc import ABC, abstractmethod
 
 
 class DynamicsRecovery(BaseDynamics):
-    def __init__(self, adata, gene, load_pars=None, **kwargs):
+    def __init__(self, adata, gene, load_pars=None, init_pars=None, **kwargs):
         super().__init__(adata, gene, **kwargs)
         if load_pars and "fit_alpha" in adata.var.keys():
             self.load_pars(adata, gene)
         elif self.recoverable:
-            self.initialize()
+            self.initialize(init_pars)
 
-    def initialize(self):
+    def initialize(self, init_pars=None):
         # set weights
-        u, s, w, perc = self.u, self.s, self.weights, 98
+        u, s, w = self.u, self.s, self.weights
         u_w = u[w]
         s_w = s[w]
 
-        # initialize scaling
-        self.std_u, self.std_s = np.std(u_w), np.std(s_w)
-        if self.std_u == 0 or self.std_s == 0:
-            self.std_u = self.std_s = 1
+        # initialize scaling, rates and steady states (see `initialize_batched`)
+        if init_pars is None:
+            _prior = self.steady_state_prior
+            prior = None if _prior is None else np.array(_prior, dtype=bool)[:, None]
+            init_pars = initialize_batched(
+                u[:, None], s[:, None], w[:, None], self.fit_scaling, prior
+            )
+            init_pars = {key: val[0] for key, val in init_pars.items()}
+        self.std_u, self.std_s = init_pars["std_u"], init_pars["std_s"]
         _scaling = self.fit_scaling
-        scaling = self.std_u / self.std_s if isinstance(_scaling, bool) else _scaling
+        scaling = init_pars["scaling"] if isinstance(_scaling, bool) else _scaling
         u, u_w = u / scaling, u_w / scaling
 
-        # initialize beta and gamma from extreme quantiles of s
-        weights_s = s_w >= np.percentile(s_w, perc, axis=0)
-        weights_u = u_w >= np.percentile(u_w, perc, axis=0)
-
-        _prior = self.steady_state_prior
-        weights_g = weights_s if _prior is None else weights_s | _prior[w]
-        beta = 1
-        gamma = linreg(convolve(u_w, weights_g), convolve(s_w, weights_g)) + 1e-6
-        # 1e-6 to avoid beta = gamma
-        # initialize gamma / beta * scaling clipped to adapt faster to extreme ratios
-        if gamma < 0.05 / scaling:
-            gamma *= 1.2
-        elif gamma > 1.5 / scaling:
-            gamma /= 1.2
-
-        u_inf, s_inf = u_w[weights_u | weights_s].mean(), s_w[weights_s].mean()
+        beta, gamma = 1, init_pars["gamma"]
+        u_inf, s_inf = init_pars["u_inf"], init_pars["s_inf"]
         u0_, s0_ = u_inf, s_inf
         alpha = u_inf * beta
         # np.mean([s_inf * gamma, u_inf * beta])  # np.mean([s0_ * gamma, u0_ * beta])
@@ -102,6 +97,8 @@ class DynamicsRecovery(BaseDynamics):
 
     def initialize_scaling(self, sight=0.5):  # fit scaling and update if improved
         z_vals = self.scaling + np.linspace(-1, 1, num=4) * self.scaling * sight
+        # candidates are updated sequentially rather than compared by their losses at
+        # once, as accepting one may shift t_ and hence the next time assignment
         for z in z_vals:
             self.update(scaling=z, beta=self.beta / self.scaling * z)
 
@@ -133,89 +130,169 @@ class DynamicsRecovery(BaseDynamics):
         self.varx = self.get_variance()
 
     def fit_alpha(self, sight=0.5, **kwargs):
-        def mse(x):
-            return self.get_mse(alpha=x[0], **kwargs)
-
         val = self.alpha
-        vals = val + np.linspace(-1, 1, num=4) * val * sight
-        for v in vals:
-            self.update(alpha=val * v)
-        res = minimize(mse, np.array([val]), **self.simplex_kwargs)
-        self.update(alpha=res.x[0])
+        bounds = (val * (1 - sight), val * (1 + sight))
+        res = self.minimize_mse_scalar("alpha", bounds, **kwargs)
+        self.update(alpha=res.x)
 
     def fit_beta(self, sight=0.5, **kwargs):
-        def mse(x):
-            return self.get_mse(beta=x[0], **kwargs)  # scaling=x[1])
-
         val = self.beta
-        vals = val + np.linspace(-1, 1, num=4) * val * sight
-        for v in vals:
-            self.update(beta=val * v)
-        res = minimize(mse, np.array([val]), **self.simplex_kwargs)
-        self.update(beta=res.x[0])
+        bounds = (val * (1 - sight), val * (1 + sight))
+        res = self.minimize_mse_scalar("beta", bounds, **kwargs)
+        self.update(beta=res.x)
 
     def fit_gamma(self, sight=0.5, **kwargs):
-        def mse(x):
-            return self.get_mse(gamma=x[0], **kwargs)
-
         val = self.gamma
-        vals = val + np.linspace(-1, 1, num=4) * val * sight
-        for v in vals:
-            self.update(gamma=val * v)
-        res = minimize(mse, np.array([val]), **self.simplex_kwargs)
-        self.update(gamma=res.x[0])
+        bounds = (val * (1 - sight), val * (1 + sight))
+        res = self.minimize_mse_scalar("gamma", bounds, **kwargs)
+        self.update(gamma=res.x)
 
     def fit_t_and_alpha(self, **kwargs):
-        def mse(x):
-            return self.get_mse(t_=x[0], alpha=x[1], **kwargs)
-
         alpha_vals = self.alpha + np.linspace(-1, 1, num=5) * self.alpha / 10
         for alpha in alpha_vals:
             self.update(alpha=alpha)
         x0, cb = np.array([self.t_, self.alpha]), self.cb_fit_t_and_alpha
-        res = minimize(mse, x0, callback=cb, **self.simplex_kwargs)  # using Nelder-Mead
+        res = self.minimize_mse(["t_", "alpha"], x0, callback=cb, **kwargs)
         self.update(t_=res.x[0], alpha=res.x[1])
 
     def fit_rates(self, **kwargs):
-        def mse(x):
-            return self.get_mse(alpha=x[0], gamma=x[1], **kwargs)
-
         x0, cb = np.array([self.alpha, self.gamma]), self.cb_fit_rates
-        res = minimize(mse, x0, tol=1e-2, callback=cb, **self.simplex_kwargs)
+        res = self.minimize_mse(["alpha", "gamma"], x0, tol=1e-2, callback=cb, **kwargs)
         self.update(alpha=res.x[0], gamma=res.x[1])
 
     def fit_t_(self, **kwargs):
-        def mse(x):
-            return self.get_mse(t_=x[0], **kwargs)
-
-        res = minimize(mse, self.t_, callback=self.cb_fit_t_, **self.simplex_kwargs)
+        x0, cb = np.array([self.t_]), self.cb_fit_t_
+        res = self.minimize_mse(["t_"], x0, callback=cb, **kwargs)
         self.update(t_=res.x[0])
 
     def fit_rates_all(self, **kwargs):
-        def mse(x):
-            return self.get_mse(alpha=x[0], beta=x[1], gamma=x[2], **kwargs)
-
         x0, cb = np.array([self.alpha, self.beta, self.gamma]), self.cb_fit_rates_all
-        res = minimize(mse, x0, tol=1e-2, callback=cb, **self.simplex_kwargs)
+        keys = ["alpha", "beta", "gamma"]
+        res = self.minimize_mse(keys, x0, tol=1e-2, callback=cb, **kwargs)
         self.update(alpha=res.x[0], beta=res.x[1], gamma=res.x[2])
 
     def fit_t_and_rates(self, **kwargs):
-        def mse(x):
-            return self.get_mse(t_=x[0], alpha=x[1], beta=x[2], gamma=x[3], **kwargs)
-
         x0 = np.array([self.t_, self.alpha, self.beta, self.gamma])
         cb = self.cb_fit_t_and_rates
-        res = minimize(mse, x0, tol=1e-2, callback=cb, **self.simplex_kwargs)
+        keys = ["t_", "alpha", "beta", "gamma"]
+        res = self.minimize_mse(keys, x0, tol=1e-2, callback=cb, **kwargs)
         self.update(t_=res.x[0], alpha=res.x[1], beta=res.x[2], gamma=res.x[3])
 
     def fit_scaling_(self, **kwargs):
-        def mse(x):
-            return self.get_mse(t_=x[0], beta=x[1], scaling=x[2], **kwargs)
-
         x0, cb = np.array([self.t_, self.beta, self.scaling]), self.cb_fit_scaling_
-        res = minimize(mse, x0, callback=cb, **self.simplex_kwargs)
+        keys = ["t_", "beta", "scaling"]
+        res = self.minimize_mse(keys, x0, callback=cb, **kwargs)
         self.update(t_=res.x[0], beta=res.x[1], scaling=res.x[2])
 
+    def minimize_mse(self, keys, x0, tol=None, callback=None, **kwargs):
+        """Minimize the mse w.r.t. the parameters named in `keys`.
+
+        Uses the downhill simplex by default (gradient-free). Gradient-based
+        optimizers (e.g. `optimizer='L-BFGS-B'`) are supplied with the analytical
+        gradient from `get_mse_and_grad` and constrained to positive parameters,
+        `optimizer='trf'` or `'dogbox'` solve the nonlinear least squares problem
+        (see `least_squares_mse`).
+        Quantities not depending on the parameters are precomputed once and
+        released after minimization.
+        """
+        opt_kwargs = dict(tol=tol, callback=callback, **self.simplex_kwargs)
+        if opt_kwargs["method"] in {"trf", "dogbox"}:
+            self._precomp = self.precompute(**kwargs)
+            try:
+                return self.least_squares_mse(keys, x0, tol, callback, **kwargs)
+            finally:
+                self._precomp = {}
+
+        stopper = None
+        if self.early_stopping:
+            stopper = EarlyStopping(self.early_stopping, callback=callback)
+            opt_kwargs["callback"] = stopper
+
+        # best iterate seen, as the optimizer may return a worse final iterate
+        best = {"loss": np.inf, "x": np.array(x0)}
+
+        def record(x, loss):
+            if loss < best["loss"]:
+                best["loss"], best["x"] = loss, np.array(x)
+            if stopper is not None:
+                stopper.record(x, loss)
+
+        if opt_kwargs["method"] in {"L-BFGS-B", "TNC", "SLSQP", "trust-constr"}:
+            idx = [["alpha", "beta", "gamma", "t_", "scaling"].index(k) for k in keys]
+
+            def mse(x):
+                loss, grad = self.get_mse_and_grad(**dict(zip(keys, x)), **kwargs)
+                record(x, loss)
+                return loss, grad[idx]
+
+            opt_kwargs.update(jac=True, bounds=[(1e-6, None)] * len(keys))
+        else:
+
+            def mse(x):
+                loss = self.get_mse(**dict(zip(keys, x)), **kwargs)
+                record(x, loss)
+                return loss
+
+        self._precomp = self.precompute(**kwargs)
+        try:
+            res = minimize(mse, x0, **opt_kwargs)
+        except StopIteration:  # halting callbacks are only handled by scipy>=1.11
+            res = OptimizeResult(x=best["x"], fun=best["loss"], success=True)
+        finally:
+            self._precomp = {}
+        if best["loss"] < res.fun:
+            res.x, res.fun = best["x"], best["loss"]
+        return res
+
+    def least_squares_mse(self, keys, x0, tol=None, callback=None, **kwargs):
+        """Minimize the mse as nonlinear least squares w.r.t. `keys`.
+
+        Uses `scipy.optimize.least_squares` with the analytical Jacobian of the
+        residuals from `get_residuals_and_jac`, where `max_iter` bounds the
+        number of residual evaluations per fitting procedure.
+        """
+        idx = [["alpha", "beta", "gamma", "t_", "scaling"].index(k) for k in keys]
+        last = {}
+
+        def residuals(x):
+            res, jac = self.get_residuals_and_jac(**dict(zip(keys, x)), **kwargs)
+            last["x"], last["jac"] = np.array(x), jac[:, idx]
+            return res
+
+        def jacobian(x):
+            if "x" not in last or not np.array_equal(last["x"], x):
+                residuals(x)
+            return last["jac"]
+
+        res = least_squares(
+            residuals,
+            np.clip(x0, 1e-6, None),
+            jac=jacobian,
+            bounds=(1e-6, np.inf),
+            method=self.simplex_kwargs["method"],
+            ftol=1e-8 if tol is None else tol,
+            max_nfev=self.simplex_kwargs["options"]["maxiter"] + 1,
+        )
+        if callback is not None:
+            callback(res.x)
+        return res
+
+    def minimize_mse_scalar(self, key, bounds, **kwargs):
+        """Minimize the mse w.r.t. the single parameter `key` within `bounds`.
+
+        Uses Brent's method (`scipy.optimize.minimize_scalar`), which converges
+        superlinearly on the smooth one-dimensional problem.
+        """
+
+        def mse(x):
+            return self.get_mse(**{key: x}, **kwargs)
+
+        self._precomp = self.precompute(**kwargs)
+        try:
+            return minimize_scalar(mse, bounds=bounds, method="bounded")
+        finally:
+            self._precomp = {}
+
     # Callback functions for the Optimizer
     def cb_fit_t_and_alpha(self, x):
         self.update(t_=x[0], alpha=x[1])
@@ -309,13 +386,167 @@ class DynamicsRecovery(BaseDynamics):
             self.t, self.tau, self.o = t, tau, o
             self.alpha, self.beta, self.gamma = alpha, beta, gamma
             self.scaling, self.t_ = scaling, t_
-            new_pars = np.array([alpha, beta, gamma, t_, scaling])[:, None]
-            self.pars = np.c_[self.pars, new_pars]
+            self.append_pars([alpha, beta, gamma, t_, scaling])
             self.loss.append(loss)
 
         return perform_update
 
 
+class EarlyStopping:
+    """Optimizer callback halting the minimization at a plateau of the loss.
+
+    Stops once the best loss improved by less than `rtol` (relative) for
+    `patience` consecutive iterations, the first one compared to the initial
+    loss. The loss is recorded by the objective via `record`, such that no
+    additional evaluations are required. Hence, it only takes effect if `patience`
+    is less than the maximal number of iterations, i.e. `max_iter / 5` per
+    fitting procedure of `DynamicsRecovery`.
+    """
+
+    def __init__(self, patience, rtol=1e-3, callback=None):
+        self.patience, self.rtol, self.callback = patience, rtol, callback
+        self.best, self.last = np.inf, np.inf
+        self.n_stale = 0
+
+    def record(self, x, loss):
+        if not np.isfinite(self.last):  # reference of the first iteration
+            self.last = loss
+        self.best = min(self.best, loss)
+
+    def __call__(self, xk, *args):
+        if self.callback is not None:
+            self.callback(xk)
+        if np.isfinite(self.last):
+            improvement = (self.last - self.best) / max(abs(self.last), 1e-12)
+            self.n_stale = self.n_stale + 1 if improvement < self.rtol else 0
+        self.last = self.best
+        if self.n_stale >= self.patience:
+            raise StopIteration
+
+
+def initialize_batched(U, S, W, fit_scaling=True, steady_state_prior=None, perc=98):
+    """Initial parameters of the dynamical model for several genes at once.
+
+    Vectorized over the columns (genes) of the (n_obs, n_vars) arrays `U` and `S`,
+    only considering observations selected by the weights `W`.
+
+    Returns
+    -------
+    init_pars: dict of per-gene arrays
+        `std_u`, `std_s`, `scaling`, `gamma`, `u_inf`, `s_inf`, with beta = 1
+        and alpha = u_inf * beta.
+    """
+    # initialize scaling
+    std_u, std_s = masked_std(U, W), masked_std(S, W)
+    zero_std = (std_u == 0) | (std_s == 0)
+    std_u[zero_std], std_s[zero_std] = 1, 1
+    _scaling = fit_scaling
+    scaling = (
+        std_u / std_s if isinstance(_scaling, bool) else np.full(len(std_u), _scaling)
+    )
+    U = U / scaling
+
+    # initialize beta and gamma from extreme quantiles of s
+    weights_s = W & (S >= percentile(S, perc, W))
+    weights_u = W & (U >= percentile(U, perc, W))
+
+    _prior = steady_state_prior
+    weights_g = weights_s if _prior is None else weights_s | W & _prior
+    U_g, S_g = convolve(U, weights_g), convolve(S, weights_g)
+    gamma = masked_sum(U_g * S_g, W) / masked_sum(S_g ** 2, W)
+    gamma = gamma.astype(np.float64) + 1e-6  # 1e-6 to avoid beta = gamma
+    # initialize gamma / beta * scaling clipped to adapt faster to extreme ratios
+    _scaling = scaling.astype(np.float64)
+    gamma = np.where(gamma < 0.05 / _scaling, gamma * 1.2, gamma)
+    gamma = np.where(gamma > 1.5 / _scaling, gamma / 1.2, gamma)
+
+    u_inf = masked_mean(U, weights_u | weights_s)
+    s_inf = masked_mean(S, weights_s)
+
+    init_pars = dict(std_u=std_u, std_s=std_s, scaling=scaling, gamma=gamma)
+    init_pars.update(dict(u_inf=u_inf, s_inf=s_inf))
+    return init_pars
+
+
+def read_layers(
+    kwargs: dict, var_names: Sequence, shared: bool = False, chunk_size=1000
+) -> dict:
+    """Read the unspliced/spliced layers of `var_names` from `adata` once.
+
+    Dense layers are copied into arrays of only `var_names`, in chunks of genes,
+    while sparse layers are kept sparse (column-compressed), to be densified per
+    gene when fitting. The layers are placed in shared memory if `shared` (see
+    `share_matrix`), and the columns of genes are given by `gene_index`.
+    """
+    adata, dtype = kwargs["adata"], kwargs["kwargs"].get("dtype")
+    cols = adata.var_names.get_indexer(var_names)
+
+    layers = []
+    for key in ["unspliced", "spliced"] if kwargs["use_raw"] else ["Mu", "Ms"]:
+        X = adata.layers[key]
+        _dtype = X.dtype if dtype is None else dtype
+        if issparse(X):
+            X = csc_matrix(X[:, cols], dtype=_dtype)
+            layers.append(share_matrix(X) if shared else X)
+            continue
+        shape = (adata.n_obs, len(cols))
+        layer = empty_shared_array(shape, _dtype) if shared else np.empty(shape, _dtype)
+        X_cols = attach_array(layer) if shared else layer
+        for i in range(0, len(cols), chunk_size):
+            X_cols[:, i : i + chunk_size] = X[:, cols[i : i + chunk_size]]
+        layers.append(layer)
+
+    gene_index = {gene: ix for ix, gene in enumerate(var_names)}
+    return dict(kwargs, layers=tuple(layers), gene_index=gene_index)
+
+
+def iter_layers(kwargs: dict, var_names: Sequence, chunk_size=1000):
+    """Iterate over chunks of `var_names` and their dense layers (see `read_layers`)."""
+    layers = [attach_matrix(X) for X in kwargs["layers"]]
+    cols = np.array([kwargs["gene_index"][gene] for gene in var_names], dtype=int)
+    for i in range(0, len(var_names), chunk_size):
+        ix = cols[i : i + chunk_size]
+        dense = (X[:, ix].toarray() if issparse(X) else X[:, ix] for X in layers)
+        yield (var_names[i : i + chunk_size], *dense)
+
+
+def get_recoverable(kwargs: dict, var_names: Sequence, chunk_size=1000) -> np.ndarray:
+    """Mask of `var_names` with sufficient samples for recovering the dynamics,
+    i.e. more than two observations with nonzero unspliced and spliced counts
+    (as in `BaseDynamics.initialize_weights`)."""
+    recoverable = []
+    for genes, U, S in iter_layers(kwargs, var_names, chunk_size):
+        if kwargs["fit_basal_transcription"]:
+            U, S = U - np.min(U, axis=0), S - np.min(S, axis=0)
+        recoverable.extend(np.sum((U > 0) & (S > 0), axis=0) > 2)
+    return np.array(recoverable, dtype=bool)
+
+
+def initialize_dynamics(kwargs: dict, var_names: Sequence, chunk_size=1000) -> dict:
+    """Initial parameters of all `var_names`, computed in batches of genes.
+
+    Returns
+    -------
+    init_pars: dict
+        Per-gene parameters as passed to `DynamicsRecovery(init_pars=...)`. Empty
+        if parameters are to be loaded or basal transcription is to be fitted.
+    """
+    if kwargs["load_pars"] or kwargs["fit_basal_transcription"]:
+        return {}
+    perc = kwargs["kwargs"].get("perc", 99)
+    prior = kwargs["steady_state_prior"]
+    prior = None if prior is None else np.array(prior, dtype=bool)[:, None]
+
+    init_pars = {}
+    for genes, U, S in iter_layers(kwargs, var_names, chunk_size):
+        W = compute_weights(U, S, perc)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pars = initialize_batched(U, S, W, kwargs["fit_scaling"], prior)
+        for j, gene in enumerate(genes):
+            init_pars[gene] = {key: val[j] for key, val in pars.items()}
+    return init_pars
+
+
 default_pars_names = ["alpha", "beta", "gamma", "t_", "scaling", "std_u", "std_s"]
 default_pars_names += ["likelihood", "u0", "s0", "pval_steady"]
 default_pars_names += ["steady_u", "steady_s", "variance"]
@@ -389,12 +620,21 @@ def work_recover_dynamics_fit_single(gene, kwargs: dict) -> Tuple:
     -------
     gene, dm:
         A tuple consisting of the identifying gene, and the fitted
-        `DynamicsRecovery` instance.
+        `DynamicsRecovery` instance reduced to a `DMResult`, unless the gene
+        is the `model_gene` whose full model is to be returned.
     """
+    # read the gene's data from the layers given by `read_layers`, if provided
+    u, s = None, None
+    if kwargs.get("layers") is not None:
+        ix = kwargs["gene_index"][gene]
+        u, s = (X[:, ix] for X in kwargs["layers"])
+
     # create dynamics recovery instance
     dm = DynamicsRecovery(
         adata=kwargs["adata"],
         gene=gene,
+        u=u,
+        s=s,
         use_raw=kwargs["use_raw"],
         load_pars=kwargs["load_pars"],
         max_iter=kwargs["max_iter"],
@@ -404,19 +644,67 @@ def work_recover_dynamics_fit_single(gene, kwargs: dict) -> Tuple:
         fit_scaling=kwargs["fit_scaling"],
         fit_basal_transcription=kwargs["fit_basal_transcription"],
         steady_state_prior=kwargs["steady_state_prior"],
+        init_pars=kwargs.get("init_pars", {}).get(gene),
         **kwargs["kwargs"],
     )
     # fit it if genes are recoverable
     if dm.recoverable:
         dm.fit(assignment_mode=kwargs["assignment_mode"])
-    return gene, dm
+    return gene, get_worker_result(dm, kwargs)
+
+
+def work_recover_dynamics_fit_batch(genes: Sequence, kwargs: dict) -> list:
+    """Fit a batch of genes, one after another.
+
+    Returns
+    -------
+    A list of `work_recover_dynamics_fit_single` outputs.
+    """
+    return [work_recover_dynamics_fit_single(gene, kwargs) for gene in genes]
+
+
+class DMResult:
+    """Fitted parameters and time assignments of a `DynamicsRecovery` instance.
+
+    Holds only the attributes read by `RecoverDynamicsFitResult.collect`, such
+    that workers return a small result instead of the full model including its
+    data and connectivities. Without `times`, the time assignments are omitted.
+    """
+
+    attributes = ["gene", "recoverable", "pars", "loss", "t", "tau", "tau_"]
+    attributes += ["u0", "s0", "pval_steady", "steady_u", "steady_s"]
+    attributes += ["std_u", "std_s", "likelihood", "varx"]
+
+    def __init__(self, dm, times=True):
+        for attr in self.attributes:
+            setattr(self, attr, getattr(dm, attr, None))
+        if not times:
+            self.t, self.tau, self.tau_ = None, None, None
+
+
+def get_worker_result(dm, kwargs: dict):
+    """Reduce a fitted `DynamicsRecovery` instance to the output of a worker.
+
+    Returns the full model for the `model_gene`, else a `DMResult`. If shared
+    `times` arrays are provided, the time assignments are written to the gene's
+    columns (by `times_index`) therein instead of being returned.
+    """
+    if dm.gene == kwargs.get("model_gene"):
+        return dm
+    times = kwargs.get("times")
+    if times is not None and dm.recoverable:
+        ix = kwargs["times_index"][dm.gene]
+        for X, x in zip(times, [dm.t, dm.tau, dm.tau_]):
+            X[:, ix] = x
+    return DMResult(dm, times=times is None)
 
 
 def work_recover_dynamics_fit_queue(
     var_names: Sequence,
-    queue: multiprocessing.Queue,
+    queue: multiprocessing.SimpleQueue,
     shared_task_counter: multiprocessing.Value,
     batch_size: int,
+    n_procs: int,
     kwargs: dict,
 ):
     """Fit a sequence of genes and write results on shared-memory queue.
@@ -430,8 +718,13 @@ def work_recover_dynamics_fit_queue(
     shared_task_counter:
         Shared-memory couunter to coordinate which workers work on what.
     batch_size:
-        Number of `var_names`entries to handle at a time. A batch size > 1
-        reduces the distributed processing communication overhead.
+        Maximum number of `var_names` entries to handle at a time. A batch
+        size > 1 reduces the distributed processing communication overhead.
+        Batches are scheduled in a guided fashion, shrinking with the number
+        of remaining genes down to single genes at the end, such that
+        expensive genes do not delay the last worker.
+    n_procs:
+        Number of workers sharing the genes.
     kwargs:
         Keyword arguments that are passed on to
         `work_recover_dynamics_fit_single`.
@@ -440,6 +733,9 @@ def work_recover_dynamics_fit_queue(
     -------
     Nothing. Results written onto queue.
     """
+    # attach to data shared by the main process
+    kwargs = attach_shared_data(kwargs)
+
     # number of genes required
     n_req = len(var_names)
 
@@ -449,10 +745,14 @@ def work_recover_dynamics_fit_queue(
             # next task intex to work on
             task_ix = shared_task_counter.value
             if task_ix < n_req:
+                # guided batch size, a fraction of the remaining genes per worker
+                n_batch = int(
+                    np.clip((n_req - task_ix) // (4 * n_procs), 1, batch_size)
+                )
                 # extract genes to work on
-                genes = var_names[task_ix : task_ix + batch_size]
+                genes = var_names[task_ix : task_ix + n_batch]
                 # set counter to next value
-                shared_task_counter.value += batch_size
+                shared_task_counter.value += n_batch
             else:
                 # no more work needed
                 return
@@ -467,6 +767,109 @@ def work_recover_dynamics_fit_queue(
         queue.put(rets)
 
 
+def empty_shared_array(shape: Tuple, dtype) -> Tuple:
+    """Allocate an (uninitialized) array in a shared-memory buffer.
+
+    The buffer is passed on to worker processes on their creation, such that
+    workers access the data without it being pickled or duplicated.
+
+    Returns
+    -------
+    buffer, shape, dtype:
+        Shared-memory buffer and the information to reconstruct the array.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buffer = multiprocessing.RawArray(np.ctypeslib.as_ctypes_type(dtype), size)
+    return buffer, tuple(shape), dtype
+
+
+def share_array(X) -> Tuple:
+    """Copy an array into a shared-memory buffer (see `empty_shared_array`)."""
+    X = np.asarray(X)
+    shared = empty_shared_array(X.shape, X.dtype)
+    attach_array(shared)[:] = X
+    return shared
+
+
+def attach_array(shared: Tuple) -> np.ndarray:
+    """View onto an array shared via `share_array`, without copying."""
+    buffer, shape, dtype = shared
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def get_fitted_data(adata, var_names: Sequence, obs_keys: Sequence = ()):
+    """Minimal `AnnData` to load the fitted parameters of `var_names` from.
+
+    Contains the fitted parameters (`.var`) and times (`.layers['fit_t']`) of
+    `var_names` only, and the observation annotations `obs_keys` if present.
+    """
+    from anndata import AnnData
+
+    fit_keys = [key for key in adata.var.keys() if key.startswith("fit_")]
+    obs_keys = [key for key in obs_keys if key in adata.obs.keys()]
+    layers = {}
+    if "fit_t" in adata.layers.keys():
+        cols = adata.var_names.get_indexer(var_names)
+        layers["fit_t"] = np.asarray(adata.layers["fit_t"])[:, cols]
+    return AnnData(
+        obs=adata.obs[obs_keys], var=adata.var.loc[var_names, fit_keys], layers=layers
+    )
+
+
+def share_matrix(X) -> Tuple:
+    """Copy a dense or sparse matrix into shared memory (see `share_array`)."""
+    if not issparse(X):
+        return share_array(X)
+    arrays = tuple(share_array(x) for x in [X.data, X.indices, X.indptr])
+    return X.format, arrays, X.shape
+
+
+def attach_matrix(shared):
+    """View onto a matrix shared via `share_matrix`, without copying.
+    Matrices that are not shared are returned as they are."""
+    if not isinstance(shared, tuple):
+        return shared
+    if not isinstance(shared[0], str):
+        return attach_array(shared)
+    fmt, arrays, shape = shared
+    matrix = csr_matrix if fmt == "csr" else csc_matrix
+    return matrix(tuple(attach_array(x) for x in arrays), shape=shape)
+
+
+def share_data(kwargs: dict, var_names: Sequence, shared: bool = True) -> dict:
+    """Prepare the data required for fitting `var_names` for the workers.
+
+    Replaces the `adata` in the worker keyword arguments, such that the workers
+    read the gene layers given by `read_layers` instead, and shares the
+    connectivities. If parameters are to be loaded, `adata` is replaced by the
+    fitted data of `var_names` (see `get_fitted_data`).
+    If not `shared`, the connectivities are kept as they are (e.g. to be
+    memory-mapped by joblib).
+    """
+    adata, conn = kwargs["adata"], kwargs["conn"]
+    if conn is not None and shared:
+        conn = share_matrix(conn)
+
+    # loading parameters also reads the fitted times (or latent time) from `adata`
+    if kwargs["load_pars"]:
+        obs_keys = ["latent_time", kwargs["kwargs"].get("refit_time")]
+        obs_keys = [key for key in obs_keys if isinstance(key, str)]
+        adata = get_fitted_data(adata, var_names, obs_keys)
+    else:
+        adata = None
+    return dict(kwargs, adata=adata, conn=conn)
+
+
+def attach_shared_data(kwargs: dict) -> dict:
+    """Attach to the data shared via `read_layers` and `share_data`."""
+    layers = tuple(attach_matrix(X) for X in kwargs["layers"])
+    kwargs = dict(kwargs, layers=layers, conn=attach_matrix(kwargs["conn"]))
+    if kwargs.get("times") is not None:
+        kwargs["times"] = tuple(attach_array(X) for X in kwargs["times"])
+    return kwargs
+
+
 class Result(ABC):
     """Abstract result base class."""
 
@@ -474,15 +877,22 @@ class Result(ABC):
     def collect(self, ret):
         """Collect worker outputs, transfer to a combined result object."""
 
+    def finalize(self):
+        """Finalize the combined result once all worker outputs are collected."""
+
 
 class RecoverDynamicsFitResult(Result):
     """Dynamics recovery fitting result.
 
-    Maintains a collection of data variables, which are iteratively filled
-    from the worker results.
+    Maintains a collection of data variables, preallocated for all genes of
+    `adata`, into which the worker results are written directly. The time
+    assignments are written to float64 layers, i.e. in place to the layers of
+    `adata` if present in float64, which are added to `adata` once all results are
+    collected (see `finalize`). With `share_times`, the time layers are allocated
+    in shared memory (see `times`), for workers to write to directly.
     """
 
-    def __init__(self, adata, var_names, plot_results: bool):
+    def __init__(self, adata, var_names, plot_results: bool, share_times=False):
         self.adata = adata
         self.var_names = var_names
         self.plot_results = plot_results
@@ -493,15 +903,11 @@ class RecoverDynamicsFitResult(Result):
         # likelihood[np.isnan(likelihood)] = 0
         idx, L = [], []
         P = [None] * 4
-        T = np.zeros(adata.shape) * np.nan
-        Tau = np.zeros(adata.shape) * np.nan
-        Tau_ = np.zeros(adata.shape) * np.nan
-        if "fit_t" in adata.layers.keys():
-            T = adata.layers["fit_t"]
-        if "fit_tau" in adata.layers.keys():
-            Tau = adata.layers["fit_tau"]
-        if "fit_tau_" in adata.layers.keys():
-            Tau_ = adata.layers["fit_tau_"]
+        # shared-memory buffers of the time layers, if any
+        self.times = [] if share_times else None
+        T, Tau, Tau_ = (
+            self.init_time_layer(key) for key in ["fit_t", "fit_tau", "fit_tau_"]
+        )
 
         self.alpha = alpha
         self.beta = beta
@@ -527,14 +933,35 @@ class RecoverDynamicsFitResult(Result):
         # remember the last dm
         self.dm = None
 
+    def init_time_layer(self, key) -> np.ndarray:
+        """The float64 time layer `key` to write the time assignments to.
+
+        An existing float64 layer of `adata` is written to in place. Otherwise, the
+        layer is allocated (in shared memory, if `times` are shared), and filled
+        with the existing times, or nan if missing.
+        """
+        adata = self.adata
+        X = adata.layers[key] if key in adata.layers.keys() else None
+        if self.times is None and isinstance(X, np.ndarray) and X.dtype == np.float64:
+            return X
+        if self.times is None:
+            layer = np.empty(adata.shape)
+        else:
+            self.times.append(empty_shared_array(adata.shape, np.float64))
+            layer = attach_array(self.times[-1])
+        layer[:] = np.nan if X is None else X
+        return layer
+
     def collect(self, ret):
         # extract
         gene, dm = ret
         if dm.recoverable:
             ix = self.adata.var_names.get_loc(gene)
             self.idx.append(ix)
+            self.L.append(dm.loss)
 
-            self.T[:, ix], self.Tau[:, ix], self.Tau_[:, ix] = dm.t, dm.tau, dm.tau_
+            if dm.t is not None:  # else written to the shared times by the worker
+                self.T[:, ix], self.Tau[:, ix], self.Tau_[:, ix] = dm.t, dm.tau, dm.tau_
             (
                 self.alpha[ix],
                 self.beta[ix],
@@ -549,7 +976,6 @@ class RecoverDynamicsFitResult(Result):
 
             self.std_u[ix], self.std_s[ix] = dm.std_u, dm.std_s
             self.likelihood[ix], self.varx[ix] = dm.likelihood, dm.varx
-            self.L.append(dm.loss)
 
             # maybe record the first few results for plotting
             if self.plot_results and gene in self.var_names[:4]:
@@ -563,6 +989,13 @@ class RecoverDynamicsFitResult(Result):
         if gene == self.var_names[-1]:
             self.dm = dm
 
+    def finalize(self):
+        # only now modify adata, e.g. not if the fitting was interrupted
+        for key, X in zip(
+            ["fit_t", "fit_tau", "fit_tau_"], [self.T, self.Tau, self.Tau_]
+        ):
+            self.adata.layers[key] = X
+
 
 class Engine(ABC):
     """Abstract execution engine base class.
@@ -621,6 +1054,7 @@ class SequentialEngine(Engine):
             ret = self.work(task, self.work_kwargs)
             self.result.collect(ret)
             progress.update()
+        self.result.finalize()
         progress.finish()
 
 
@@ -634,7 +1068,9 @@ class MultiprocessingEngine(Engine):
     distribution overhead is low.
 
     Uses the python `multiprocessing` module to generate parallel processes.
-    Note: The exact way of spawning is platform-dependent.
+    Note: The exact way of spawning is platform-dependent. Large inputs should
+    therefore be shared with the workers via `share_array` rather than being
+    passed in `work_kwargs`, which are pickled on spawning.
 
     Parameters
     ----------
@@ -643,7 +1079,7 @@ class MultiprocessingEngine(Engine):
         both regarding the available number of cores, and the single-process
         parallelization.
     batch_size:
-        Batch size how many results are to be calculated at a time.
+        Batch size how many results are to be calculated at a time at most.
     """
 
     def __init__(
@@ -661,15 +1097,16 @@ class MultiprocessingEngine(Engine):
 
     def run(self):
         """Run all tasks on a specified number of workers."""
-        # inter-process communication queue for outputs
-        queue = multiprocessing.Queue()
+        # inter-process communication queue for outputs, without a feeder thread
+        queue = multiprocessing.SimpleQueue()
 
         # shared-memory task counter
         task_ix = multiprocessing.Value(ctypes.c_longlong)
         task_ix.value = 0
 
         # arguments to pass to the worker
-        args = (self.tasks, queue, task_ix, self.batch_size, self.work_kwargs)
+        args = (self.tasks, queue, task_ix, self.batch_size, self.n_procs)
+        args += (self.work_kwargs,)
 
         # worker processes
         processes = [
@@ -691,7 +1128,7 @@ class MultiprocessingEngine(Engine):
         progress = logg.ProgressReporter(n_req)
         while n_done < n_req:
             # read from worker output queue
-            rets = queue.get(block=True)
+            rets = queue.get()
             # the results are batched for efficiency
             for ret in rets:
                 # process result
@@ -700,11 +1137,68 @@ class MultiprocessingEngine(Engine):
                 progress.update()
 
         # tidy up
+        self.result.finalize()
         progress.finish()
         for p in processes:
             p.join()
 
 
+class JoblibEngine(Engine):
+    """Parallel task execution via `joblib`.
+
+    Dispatches batches of tasks to `joblib.Parallel`, such that any joblib
+    backend can be used, e.g. `'loky'` with its reusable pool of worker
+    processes, or `'dask'` for distributed execution on a cluster. Large arrays
+    in `work_kwargs` are memory-mapped by joblib instead of being copied to
+    every worker.
+
+    Parameters
+    ----------
+    work:
+        The worker function, handling a batch (sequence) of tasks and returning
+        a list of outputs.
+    n_procs:
+        Number of parallel jobs.
+    batch_size:
+        Number of tasks dispatched to a worker at a time.
+    backend:
+        Name of the joblib backend. If `None`, the backend configured by
+        `joblib.parallel_backend` is used, defaulting to `'loky'`.
+    """
+
+    def __init__(
+        self,
+        work: Callable,
+        work_kwargs: dict,
+        tasks: Sequence,
+        result: Result,
+        n_procs: int,
+        batch_size: int = 50,
+        backend: str = None,
+    ):
+        super().__init__(work=work, work_kwargs=work_kwargs, tasks=tasks, result=result)
+        self.n_procs = n_procs
+        self.batch_size = batch_size
+        self.backend = backend
+
+    def run(self):
+        """Run all tasks on a specified number of joblib workers."""
+        from joblib import Parallel, delayed
+
+        n_tasks, b = len(self.tasks), self.batch_size
+        batches = [self.tasks[i : i + b] for i in range(0, n_tasks, b)]
+        parallel = Parallel(n_jobs=self.n_procs, backend=self.backend)
+        work = delayed(self.work)
+
+        progress = logg.ProgressReporter(n_tasks)
+        for rets in parallel(work(batch, self.work_kwargs) for batch in batches):
+            for ret in rets:
+                self.result.collect(ret)
+                progress.update()
+        self.result.finalize()
+        progress.finish()
+
+
 class RecoverDynamicsSequentialEngine(SequentialEngine):
     """Sequential engine for dynamics recovery.
     Convenience wrapper around `SequentialEngine`.
@@ -722,16 +1216,26 @@ class RecoverDynamicsSequentialEngine(SequentialEngine):
 class RecoverDynamicsMultiprocessingEngine(MultiprocessingEngine):
     """Multiprocessing parallel engine for dynamics recovery.
     Convenience wrapper around `MultiprocessingEngine`.
+
+    The gene layers (see `read_layers`) and connectivities are placed in shared
+    memory once, instead of passing the full `adata` to every worker. Likewise,
+    the workers write the time assignments directly to the time layers of the
+    result, placed in shared memory, instead of returning them via the queue.
     """
 
     def __init__(
         self,
         work_kwargs: dict,
         tasks: Sequence,
-        result: Result,
+        result: RecoverDynamicsFitResult,
         n_procs: int,
         batch_size: int,
     ):
+        work_kwargs = share_data(work_kwargs, tasks)
+        work_kwargs["times"] = tuple(result.times)
+        times_index = result.adata.var_names.get_indexer(tasks)
+        work_kwargs["times_index"] = dict(zip(tasks, times_index))
+
         super().__init__(
             work=work_recover_dynamics_fit_queue,
             work_kwargs=work_kwargs,
@@ -742,6 +1246,35 @@ class RecoverDynamicsMultiprocessingEngine(MultiprocessingEngine):
         )
 
 
+class RecoverDynamicsJoblibEngine(JoblibEngine):
+    """Joblib parallel engine for dynamics recovery.
+    Convenience wrapper around `JoblibEngine`.
+
+    The gene layers are passed on as arrays of only the genes to fit (see
+    `read_layers`), instead of passing the full `adata` to every worker, to be
+    memory-mapped by joblib.
+    """
+
+    def __init__(
+        self,
+        work_kwargs: dict,
+        tasks: Sequence,
+        result: Result,
+        n_procs: int,
+        batch_size: int,
+        backend: str = None,
+    ):
+        super().__init__(
+            work=work_recover_dynamics_fit_batch,
+            work_kwargs=share_data(work_kwargs, tasks, shared=False),
+            tasks=tasks,
+            result=result,
+            n_procs=n_procs,
+            batch_size=batch_size,
+            backend=backend,
+        )
+
+
 """Main routines"""
 
 
@@ -766,6 +1299,7 @@ def recover_dynamics(
     copy=False,
     n_procs: int = 1,
     batch_size: int = 10,
+    backend: str = None,
     **kwargs,
 ):
     """Recovers the full splicing kinetics of specified genes.
@@ -822,7 +1356,15 @@ def recover_dynamics(
         systems.
         For details see `scvelo.tools.dynamical_model.MultiprocessingEngine`.
     batch_size: `int` (default: 10)
-        Batch size to use in parallelization. Only applies if `n_procs` > 1.
+        Maximum batch size to use in parallelization, with batches shrinking
+        towards the end. Only applies if `n_procs` > 1.
+    backend: `str` or `None` (default: `None`)
+        Backend to parallelize on if `n_procs` > 1. By default, the built-in
+        `multiprocessing` engine is used. Else, the name of a `joblib` backend,
+        e.g. `'loky'` or `'dask'`, or `'joblib'` to use the backend configured
+        via `joblib.parallel_backend`. Ignored if `n_procs` is 1, in which case
+        the genes are fitted sequentially.
+        For details see `scvelo.tools.dynamical_model.JoblibEngine`.
 
     Returns
     -------
@@ -856,6 +1398,13 @@ def recover_dynamics(
 
     conn = get_connectivities(adata) if fit_connected_states else None
 
+    early_stopping = kwargs.get("early_stopping")
+    if early_stopping and early_stopping >= int(max_iter / 5):
+        logg.warn(
+            f"early_stopping={early_stopping} has no effect with max_iter={max_iter}, "
+            "i.e. max_iter / 5 iterations per fitting procedure."
+        )
+
     # arguments to pass on to the fitting workers
     work_kwargs = dict(
         adata=adata,
@@ -869,25 +1418,53 @@ def recover_dynamics(
         fit_basal_transcription=fit_basal_transcription,
         steady_state_prior=steady_state_prior,
         assignment_mode=assignment_mode,
+        model_gene=var_names[-1],
         kwargs=kwargs,
     )
+    # read the layers of all genes once, in shared memory for multiprocessing
+    shared = n_procs > 1 and backend is None
+    work_kwargs = read_layers(work_kwargs, var_names, shared=shared)
+
+    # skip genes not recoverable, except the last one whose model is returned
+    recoverable = get_recoverable(work_kwargs, var_names)
+    recoverable[-1] = True
+    for gene in var_names[~recoverable]:
+        logg.warn(gene, "not recoverable due to insufficient samples.")
+    tasks = var_names[recoverable]
+
+    # initial parameters of all genes at once
+    work_kwargs["init_pars"] = initialize_dynamics(work_kwargs, tasks)
 
     # prepare a result object which the engine writes to
     result = RecoverDynamicsFitResult(
-        adata=adata, var_names=var_names, plot_results=plot_results
+        adata=adata,
+        var_names=var_names,
+        plot_results=plot_results,
+        share_times=shared,
     )
     # define engine for the fitting
-    if n_procs > 1:
+    if n_procs > 1 and backend is not None:
+        engine = RecoverDynamicsJoblibEngine(
+            work_kwargs=work_kwargs,
+            tasks=tasks,
+            result=result,
+            n_procs=n_procs,
+            batch_size=batch_size,
+            backend=None if backend == "joblib" else backend,
+        )
+    elif n_procs > 1:
         engine = RecoverDynamicsMultiprocessingEngine(
             work_kwargs=work_kwargs,
-            tasks=var_names,
+            tasks=tasks,
             result=result,
             n_procs=n_procs,
             batch_size=batch_size,
         )
     else:
+        if backend is not None:
+            logg.warn(f"Ignoring backend={backend!r}, as it requires n_procs > 1.")
         engine = RecoverDynamicsSequentialEngine(
-            work_kwargs=work_kwargs, tasks=var_names, result=result
+            work_kwargs=work_kwargs, tasks=tasks, result=result
         )
     # execute engine, fills result
     engine.run()
@@ -911,8 +1488,6 @@ def recover_dynamics(
     L = result.L
     P = result.P
     T = result.T
-    Tau = result.Tau
-    Tau_ = result.Tau_
 
     dm = result.dm
 
@@ -933,31 +1508,32 @@ def recover_dynamics(
         varx,
     ]
     write_pars(adata, _pars)
-    if "fit_t" in adata.layers.keys():
-        adata.layers["fit_t"][:, idx] = (
-            T[:, idx] if conn is None else conn.dot(T[:, idx])
-        )
-    else:
-        adata.layers["fit_t"] = T if conn is None else conn.dot(T)
-    adata.layers["fit_tau"] = Tau
-    adata.layers["fit_tau_"] = Tau_
+    if conn is not None:
+        T[:, idx] = conn.dot(T[:, idx])
 
     if L:  # is False if only one invalid / irrecoverable gene was given in var_names
         cur_len = adata.varm["loss"].shape[1] if "loss" in adata.varm.keys() else 2
         max_len = max(np.max([len(l) for l in L]), cur_len) if L else cur_len
-        loss = np.ones((adata.n_vars, max_len)) * np.nan
+        loss = np.full((adata.n_vars, max_len), np.nan)
 
         if "loss" in adata.varm.keys():
             loss[:, :cur_len] = adata.varm["loss"]
 
-        loss[idx] = np.vstack(
-            [np.concatenate([l, np.ones(max_len - len(l)) * np.nan]) for l in L]
-        )
+        # pad the losses of the fitted genes with nan to a common length
+        loss_idx = np.full((len(L), max_len), np.nan)
+        for i, l in enumerate(L):
+            loss_idx[i, : len(l)] = l
+        loss[idx] = loss_idx
         adata.varm["loss"] = loss
 
     if t_max is not False:
         dm = align_dynamics(adata, t_max=t_max, dm=dm, idx=idx)
 
+    # store the times at the precision of `settings.fit_dtype` once aligned,
+    # a storage dtype only, as the times are computed in float64
+    for key in ["fit_t", "fit_tau", "fit_tau_"]:
+        adata.layers[key] = adata.layers[key].astype(settings.fit_dtype, copy=False)
+
     logg.info("    finished", time=True, end=" " if settings.verbosity > 2 else "\n")
     logg.hint(
         "added \n"
@@ -971,10 +1547,12 @@ def recover_dynamics(
         fontsize = rcParams["font.size"]
         fig, axes = pl.subplots(nrows=n_rows, ncols=6, figsize=figsize)
         pl.subplots_adjust(wspace=0.7, hspace=0.5)
+        if t_max is not False:  # alignment scaling of alpha, beta, gamma, t_
+            m = dm.m[:n_rows]
+            P_scaling = np.array([1 / m, 1 / m, 1 / m, m, np.ones(n_rows)])
         for i, gene in enumerate(var_names[:4]):
             if t_max is not False:
-                mi = dm.m[i]
-                P[i] *= np.array([1 / mi, 1 / mi, 1 / mi, mi, 1])[:, None]
+                P[i] *= P_scaling[:, i, None]
             ax = axes[i] if n_rows > 1 else axes
             for j, pij in enumerate(P[i]):
                 ax[j].plot(pij)
@@ -1024,16 +1602,16 @@ def align_dynamics(
     adata = data.copy() if copy else data
     pars_names = ["alpha", "beta", "gamma", "t_", "scaling", "alignment_scaling"]
     alpha, beta, gamma, t_, scaling, mz = read_pars(adata, pars_names=pars_names)
-    T = np.zeros(adata.shape) * np.nan
-    Tau = np.zeros(adata.shape) * np.nan
-    Tau_ = np.zeros(adata.shape) * np.nan
+    T = np.full(adata.shape, np.nan, dtype=settings.fit_dtype)
+    Tau = np.full(adata.shape, np.nan, dtype=settings.fit_dtype)
+    Tau_ = np.full(adata.shape, np.nan, dtype=settings.fit_dtype)
     if "fit_t" in adata.layers.keys():
         T = adata.layers["fit_t"]
     if "fit_tau" in adata.layers.keys():
         Tau = adata.layers["fit_tau"]
     if "fit_tau_" in adata.layers.keys():
         Tau_ = adata.layers["fit_tau_"]
-    idx = ~np.isnan(np.sum(T, axis=0)) if idx is None else idx
+    idx = ~np.isnan(T).any(axis=0) if idx is None else idx
     if "fit_alignment_scaling" not in adata.var.keys():
         mz = np.ones(adata.n_vars)
     if mode is None:
@@ -1045,11 +1623,16 @@ def align_dynamics(
     if dm is not None:  # newly fitted
         mz[idx] = 1
 
+    cols = np.arange(adata.n_vars)[idx]
     if mode == "align_total_time" and t_max is not False:
-        T_max = np.max(T[:, idx] * (T[:, idx] < t_[idx]), axis=0)  # transient 'on'
-        T_max += np.max((T[:, idx] - t_[idx]) * (T[:, idx] > t_[idx]), axis=0)  # 'off'
+        t_idx = t_[idx]
+        T_on_max, T_off_max, n_steady = align_reductions(
+            T, t_idx, t_idx.astype(T.dtype), cols
+        )
+        T_max = T_on_max  # transient 'on'
+        T_max += T_off_max  # transient 'off'
 
-        denom = 1 - np.sum((T[:, idx] == t_[idx]) | (T[:, idx] == 0), axis=0) / len(T)
+        denom = 1 - n_steady / len(T)
         denom += denom == 0
 
         T_max = T_max / denom
@@ -1068,16 +1651,14 @@ def align_dynamics(
         mz = np.clip(mz, mu - 3 * std, mu + 3 * std)
         m = mz / mz_prev
 
-    if idx is None:
-        alpha, beta, gamma = alpha / m, beta / m, gamma / m
-        T, t_, Tau, Tau_ = T * m, t_ * m, Tau * m, Tau_ * m
-    else:
-        m_ = m[idx]
-        alpha[idx] = alpha[idx] / m_
-        beta[idx] = beta[idx] / m_
-        gamma[idx] = gamma[idx] / m_
-        T[:, idx], t_[idx] = T[:, idx] * m_, t_[idx] * m_
-        Tau[:, idx], Tau_[:, idx] = Tau[:, idx] * m_, Tau_[:, idx] * m_
+    # rescale the aligned genes in place
+    m_ = m[idx]
+    alpha[cols] /= m_
+    beta[cols] /= m_
+    gamma[cols] /= m_
+    t_[cols] *= m_
+    for X in [T, Tau, Tau_]:
+        scale_columns(X, cols, m_)
 
     mz[mz == 1] = np.nan
     pars_names = ["alpha", "beta", "gamma", "t_", "alignment_scaling"]
@@ -1098,6 +1679,25 @@ def align_dynamics(
     return adata if copy else dm
 
 
+def _as_bool_mask(values: pd.Series) -> np.ndarray:
+    """Mask of the cells marked in an `adata.obs` column.
+
+    Cells are marked by any string label if the column contains strings, else by
+    values close to 1 (e.g. root/end point probabilities), missing values unmarked.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        is_str = np.append([isinstance(c, str) for c in categories], False)
+        if np.any(is_str):
+            return is_str[values.cat.codes.values]  # missing values have code -1
+        values = values.astype(float)
+    elif values.dtype.kind == "O":
+        is_str = values.map(type).values == str
+        if np.any(is_str):
+            return is_str
+    return values.fillna(0).to_numpy(dtype=np.float64) > 1 - 1e-3
+
+
 def latent_time(
     data,
     vkey="velocity",
@@ -1153,6 +1753,7 @@ def latent_time(
 
     from .utils import vcorrcoef, scale
     from .dynamical_model_utils import root_time, compute_shared_time
+    from .dynamical_model_utils import low_confidence_mask
     from .terminal_states import terminal_states
     from .velocity_graph import velocity_graph
     from .velocity_pseudotime import velocity_pseudotime
@@ -1173,8 +1774,8 @@ def latent_time(
     if root_key not in adata.obs.keys():
         terminal_states(adata, vkey=vkey)
 
-    t = np.array(adata.layers["fit_t"])
-    idx_valid = ~np.isnan(t.sum(0))
+    t = np.asarray(adata.layers["fit_t"])  # copied below, when selecting genes
+    idx_valid = ~np.isnan(t).any(axis=0)
     if min_likelihood is not None:
         likelihood = adata.var["fit_likelihood"].values
         idx_valid &= np.array(likelihood >= min_likelihood, dtype=bool)
@@ -1184,11 +1785,7 @@ def latent_time(
 
     if root_key not in adata.uns.keys():
         roots = np.argsort(t_sum)
-        idx_roots = np.array(adata.obs[root_key][roots])
-        idx_roots[pd.isnull(idx_roots)] = 0
-        if np.any([isinstance(ix, str) for ix in idx_roots]):
-            idx_roots = np.array([isinstance(ix, str) for ix in idx_roots], dtype=int)
-        idx_roots = idx_roots.astype(np.float) > 1 - 1e-3
+        idx_roots = _as_bool_mask(adata.obs[root_key].iloc[roots])
         if np.sum(idx_roots) > 0:
             roots = roots[idx_roots]
         else:
@@ -1202,11 +1799,7 @@ def latent_time(
 
     if end_key in adata.obs.keys():
         fates = np.argsort(t_sum)[::-1]
-        idx_fates = np.array(adata.obs[end_key][fates])
-        idx_fates[pd.isnull(idx_fates)] = 0
-        if np.any([isinstance(ix, str) for ix in idx_fates]):
-            idx_fates = np.array([isinstance(ix, str) for ix in idx_fates], dtype=int)
-        idx_fates = idx_fates.astype(np.float) > 1 - 1e-3
+        idx_fates = _as_bool_mask(adata.obs[end_key].iloc[fates])
         if np.sum(idx_fates) > 0:
             fates = fates[idx_fates]
     else:
@@ -1251,18 +1844,16 @@ def latent_time(
     tc = conn.dot(latent_time)
 
     z = tl.dot(tc) / tc.dot(tc)
-    tl_conf = (1 - np.abs(tl / np.max(tl) - tc * z / np.max(tl))) ** 2
-    idx_low_confidence = tl_conf < min_confidence
+    idx_low_confidence = low_confidence_mask(tl, tc, z, min_confidence)
 
     if weight_diffusion is not None:
         w = weight_diffusion
         latent_time = (1 - w) * latent_time + w * vpt
         latent_time[idx_low_confidence] = vpt[idx_low_confidence]
     else:
-        conn_new = conn.copy()
-        conn_new[:, idx_low_confidence] = 0
-        conn_new.eliminate_zeros()
-        latent_time = conn_new.dot(latent_time)
+        # smooth over neighbors, excluding low-confidence cells (as zeroing their
+        # columns in `conn`, without copying it)
+        latent_time = conn.dot(latent_time * ~idx_low_confidence)
 
     latent_time = scale(latent_time)
     if t_max is not None:
@@ -1278,6 +1869,14 @@ def latent_time(
 recover_latent_time = latent_time
 
 
+def _to_recarray(columns, names, dtype):
+    """Record array with one field per name, filled from the rows of `columns`."""
+    out = np.empty(columns.shape[1], dtype=[(f"{name}", dtype) for name in names])
+    for name, col in zip(out.dtype.names, columns):
+        out[name] = col
+    return out.view(np.recarray)
+
+
 def differential_kinetic_test(
     data,
     var_names="velocity_genes",
@@ -1378,18 +1977,22 @@ def differential_kinetic_test(
     else:
         diff_kinetics = np.empty(adata.n_vars, dtype="|U16")
     idx = []
+    gene_positions = adata.var_names.get_indexer(var_names)
+    cluster_masks = get_cluster_masks(clusters)
 
     progress = logg.ProgressReporter(len(var_names))
     for i, gene in enumerate(var_names):
         dm = DynamicsRecovery(adata, gene, use_raw=use_raw, load_pars=True, max_iter=0)
         if dm.recoverable:
-            dm.differential_kinetic_test(clusters, **kwargs)
+            dm.differential_kinetic_test(
+                clusters, cluster_masks=cluster_masks, **kwargs
+            )
 
-            ix = adata.var_names.get_loc(gene)
+            ix = gene_positions[i]
             idx.append(ix)
             diff_kinetics[ix] = dm.diff_kinetics
             pval_kinetics[ix] = dm.pval_kinetics
-            pvals[ix] = np.array(dm.pvals_kinetics)
+            pvals[ix] = dm.pvals_kinetics
 
             progress.update()
         else:
@@ -1399,9 +2002,7 @@ def differential_kinetic_test(
 
     pars_names = ["diff_kinetics", "pval_kinetics"]
     write_pars(adata, [diff_kinetics, pval_kinetics], pars_names=pars_names)
-    adata.varm[f"{add_key}_pvals_kinetics"] = np.rec.fromarrays(
-        pvals.T, dtype=[(f"{rn}", "float32") for rn in groups]
-    ).T
+    adata.varm[f"{add_key}_pvals_kinetics"] = _to_recarray(pvals.T, groups, "float32")
     adata.uns["recover_dynamics"]["fit_diff_kinetics"] = groupby
 
     logg.info("    finished", time=True, end=" " if settings.verbosity > 2 else "\n")
@@ -1471,23 +2072,24 @@ def rank_dynamical_genes(data, n_genes=100, groupby=None, copy=False):
         clusters=adata.obs[groupby],
     )
 
-    idx_sorted = np.argsort(np.nan_to_num(ll), 1)[:, ::-1][:, :n_genes]
-    rankings_gene_names = vdata.var_names[idx_sorted]
-    rankings_gene_scores = np.sort(np.nan_to_num(ll), 1)[:, ::-1][:, :n_genes]
+    # partial sort, selecting the genes scoring at least the n_genes-th largest score
+    # per group before sorting them, with ties ranked by descending index as in a
+    # reversed (stable) full sort
+    ll = np.nan_to_num(ll)
+    n_top = min(n_genes, ll.shape[1])
+    kth = np.partition(ll, ll.shape[1] - n_top, axis=1)[:, ll.shape[1] - n_top]
+    idx_sorted = []
+    for ll_group, kth_group in zip(ll, kth):
+        idx = np.flatnonzero(ll_group >= kth_group)
+        idx_sorted.append(idx[np.lexsort((-idx, -ll_group[idx]))][:n_top])
+    idx_sorted = np.array(idx_sorted)
+    rankings_gene_names = vdata.var_names.to_numpy()[idx_sorted]
+    rankings_gene_scores = np.take_along_axis(ll, idx_sorted, axis=1)
 
     key = "rank_dynamical_genes"
-    if key not in adata.uns.keys():
-        adata.uns[key] = {}
-
     adata.uns[key] = {
-        "names": np.rec.fromarrays(
-            [n for n in rankings_gene_names],
-            dtype=[(f"{rn}", "U50") for rn in groups],
-        ),
-        "scores": np.rec.fromarrays(
-            [n.round(2) for n in rankings_gene_scores],
-            dtype=[(f"{rn}", "float32") for rn in groups],
-        ),
+        "names": _to_recarray(rankings_gene_names, groups, "U50"),
+        "scores": _to_recarray(rankings_gene_scores.round(2), groups, "float32"),
     }
 
     logg.info("    finished", time=True, end=" " if settings.verbosity > 2 else "\n")
@@ -12,6 +12,7 @@ from scipy.sparse import issparse
 import warnings
 import pandas as pd
 import numpy as np
+from numba import njit
 
 exp = np.exp
 
@@ -51,6 +52,72 @@ def linreg(u, s):  # linear regression fit
     return us_ / ss_
 
 
+def percentile(X, q, mask=None):
+    """Percentile along axis 0 (linear interpolation as in `np.percentile`),
+    computed over the entries selected by `mask`, vectorized over columns.
+
+    Only the order statistics above the percentile are sorted, after selecting
+    them by a partition in linear time. 32-bit floats are sorted right away, as
+    numpy's vectorized sorting kernels outperform the partition for these.
+    Sparse inputs are densified, as the percentile may also be among the zeros.
+    """
+    X = X.toarray() if issparse(X) else np.asarray(X)
+    N = len(X)
+    n = np.full(X.shape[1], N) if mask is None else np.sum(mask, axis=0)
+    idx = np.clip((n - 1) * (q / 100), 0, None)
+    lo = np.floor(idx).astype(int)
+    hi = np.minimum(lo + 1, np.clip(n - 1, 0, None))
+    t = idx - lo
+
+    if X.dtype == np.float32:  # sorted with masked entries (nan) placed last
+        k, i0 = N, np.zeros_like(n)
+        X = np.sort(X if mask is None else np.where(mask, X, np.nan), axis=0)
+    else:  # the k largest entries per column contain the order statistics lo, hi
+        k = int(np.clip(np.max(n - lo, initial=1), 1, N))
+        i0 = k - n
+        X = X if mask is None else np.where(mask, X, -np.inf)
+        X = np.sort(np.partition(X, N - k, axis=0)[N - k :], axis=0)
+
+    cols = np.arange(X.shape[1])
+    a, b = (X[np.clip(i0 + i, 0, k - 1), cols] for i in [lo, hi])
+    with np.errstate(invalid="ignore"):
+        perc = np.where(t >= 0.5, b - (b - a) * (1 - t), a + (b - a) * t)
+    return np.where(n > 0, perc, np.nan)
+
+
+def compute_weights(u, s, perc=None):
+    """Mask of observations with nonzero u and s, clipped at the upper `perc`
+    percentile of either, computed column-wise for (n_obs, n_vars) arrays."""
+    weights = (s > 0) & (u > 0)
+    if perc is not None:
+        ub_s, ub_u = percentile(s, perc, weights), percentile(u, perc, weights)
+        weights &= (s <= ub_s) | ~(ub_s > 0)
+        weights &= (u <= ub_u) | ~(ub_u > 0)
+    return weights
+
+
+def masked_sum(X, mask):
+    """Column-wise sums over the entries selected by `mask`, each summed in the
+    same order as `X[mask[:, j], j].sum()` to reproduce the per-gene numerics."""
+    n = np.sum(mask, axis=0)
+    x = X.T[mask.T]
+    bounds = np.cumsum(n)
+    return np.array([x[b - k : b].sum() for k, b in zip(n, bounds)], dtype=X.dtype)
+
+
+def masked_mean(X, mask):
+    """Column-wise mean over the entries selected by `mask`, as `np.mean`."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = np.sum(mask, axis=0)
+        return (masked_sum(X, mask).astype(np.float64) / n).astype(X.dtype)
+
+
+def masked_std(X, mask):
+    """Column-wise standard deviation over the entries selected by `mask`."""
+    dev = np.where(mask, X - masked_mean(X, mask), 0)
+    return np.sqrt(masked_mean(dev * dev, mask))
+
+
 def compute_dt(t, clipped=True, axis=0):
     prepend = np.min(t, axis=axis)[None, :]
     dt = np.diff(np.sort(t, axis=axis), prepend=prepend, axis=axis)
@@ -67,17 +134,50 @@ def root_time(t, root=None):
     if np.any(nans):
         t = t[:, ~nans]
 
-    t_root = 0 if root is None else t[root]
-    o = np.array(t >= t_root, dtype=int)
-    t_after = (t - t_root) * o
-    t_origin = np.max(t_after, axis=0)
-    t_before = (t + t_origin) * (1 - o)
+    t_root = np.zeros(t.shape[1], dtype=t.dtype) if root is None else t[root]
+    return root_time_kernel(t, t_root)
+
+
+@njit(cache=True, nogil=True)
+def root_time_kernel(t, t_root):
+    """Shift the times `t` of each gene (column) to start at the root cell's time.
 
-    t_switch = np.min(t_before, axis=0)
-    t_rooted = t_after + t_before
+    Times after the root's time `t_root` are shifted by -t_root, and times before
+    it are appended behind the latest of these, as the origin wraps around.
+    Runs in two passes over `t`, returning the rooted times and the switching
+    times, i.e. the earliest of the appended times per gene.
+    """
+    n_obs, n_vars = t.shape
+    t_origin = np.full(n_vars, -np.inf)
+    for i in range(n_obs):
+        for j in range(n_vars):
+            o = 1 if t[i, j] >= t_root[j] else 0
+            t_origin[j] = max(t_origin[j], (t[i, j] - t_root[j]) * o)
+
+    t_rooted = np.empty((n_obs, n_vars))
+    t_switch = np.full(n_vars, np.inf)
+    for i in range(n_obs):
+        for j in range(n_vars):
+            o = 1 if t[i, j] >= t_root[j] else 0
+            t_before = (t[i, j] + t_origin[j]) * (1 - o)
+            t_rooted[i, j] = (t[i, j] - t_root[j]) * o + t_before
+            t_switch[j] = min(t_switch[j], t_before)
     return t_rooted, t_switch
 
 
+@njit(cache=True, nogil=True)
+def low_confidence_mask(tl, tc, z, min_confidence):
+    """Mask of cells whose latent time `tl` deviates from its neighbor-smoothed
+    counterpart `tc` (regressed onto `tl` by `z`), i.e. with a confidence
+    `(1 - |tl - z * tc| / max(tl)) ** 2` below `min_confidence`."""
+    tl_max = np.max(tl)
+    mask = np.empty(len(tl), dtype=np.bool_)
+    for i in range(len(tl)):
+        conf = (1 - np.abs(tl[i] / tl_max - tc[i] * z / tl_max)) ** 2
+        mask[i] = conf < min_confidence
+    return mask
+
+
 def compute_shared_time(t, perc=None, norm=True):
     nans = np.isnan(np.sum(t, axis=0))
     if np.any(nans):
@@ -125,6 +225,101 @@ def mRNA(tau, u0, s0, alpha, beta, gamma):
     return u, s
 
 
+def mRNA_grad(tau, u0, s0, alpha, beta, gamma):
+    """Partial derivatives of the analytical solution `mRNA` with respect to
+    (tau, u0, s0, alpha, beta, gamma), each stacked as rows of (du, ds)."""
+    expu, exps = exp(-beta * tau), exp(-gamma * tau)
+    inv_gb = inv(gamma - beta)
+    c = (alpha - u0 * beta) * inv_gb
+
+    du_dtau = (alpha - beta * u0) * expu
+    du_du0 = expu
+    du_dalpha = (1 - expu) / beta
+    du_dbeta = -tau * u0 * expu - alpha / beta ** 2 * (1 - expu)
+    du_dbeta += alpha / beta * tau * expu
+
+    ds_dtau = (alpha - gamma * s0) * exps + c * (beta * expu - gamma * exps)
+    ds_du0 = -beta * inv_gb * (exps - expu)
+    ds_ds0 = exps
+    ds_dalpha = (1 - exps) / gamma + inv_gb * (exps - expu)
+    ds_dbeta = (alpha - gamma * u0) * inv_gb ** 2 * (exps - expu) + c * tau * expu
+    ds_dgamma = -tau * s0 * exps - alpha / gamma ** 2 * (1 - exps)
+    ds_dgamma += alpha / gamma * tau * exps - c * inv_gb * (exps - expu)
+    ds_dgamma -= c * tau * exps
+
+    zeros = np.zeros_like(expu)
+    du = [du_dtau, du_du0, zeros, du_dalpha, du_dbeta, zeros]
+    ds = [ds_dtau, ds_du0, ds_ds0, ds_dalpha, ds_dbeta, ds_dgamma]
+    return np.array(du), np.array(ds)
+
+
+@njit(cache=True, nogil=True)
+def align_reductions(T, t_, t_cast, cols):
+    """Column reductions of the fitted times `T` used by `align_dynamics`.
+
+    In a single pass over `T[:, cols]`, computes the maximal time of the
+    transient 'on' and 'off' states, i.e. the column maxima of `T * (T < t_)` and
+    `(T - t_) * (T > t_)`, and the number of times at the switching point or at 0.
+    The times are compared to `t_cast`, the switching times `t_` in the dtype of
+    `T`, such that times stored at lower precision still match the switching point.
+    """
+    on_max, off_max = np.full(len(cols), -np.inf), np.full(len(cols), -np.inf)
+    n_steady = np.zeros(len(cols), dtype=np.int64)
+    for i in range(T.shape[0]):
+        for j in range(len(cols)):
+            t, t_j, t_c = T[i, cols[j]], t_[j], t_cast[j]
+            on, off = t * (t < t_c), (t - t_j) * (t > t_c)
+            if on > on_max[j] or on != on:
+                on_max[j] = on
+            if off > off_max[j] or off != off:
+                off_max[j] = off
+            n_steady[j] += (t == t_c) | (t == 0)
+    return on_max, off_max, n_steady
+
+
+@njit(cache=True, nogil=True)
+def scale_columns(X, cols, m):
+    """Multiply the columns `cols` of `X` in place by the factors `m`."""
+    for i in range(X.shape[0]):
+        for j in range(len(cols)):
+            X[i, cols[j]] *= m[j]
+
+
+@njit(cache=True, nogil=True)
+def distx_kernel(t, u, s, t_, t_cast, alpha, beta, gamma, scaling, std_u, std_s):
+    """Squared distances of (u, s) to the trajectory at assigned times t.
+
+    Fused numeric core of `BaseDynamics.get_mse`, evaluating `vectorize`, `mRNA`
+    and the residuals of `get_distx` per observation in a single pass with the
+    same operations, where `t_cast` is the switching time `t_` in the dtype of
+    `t` (as numpy casts it when comparing and subtracting).
+    """
+    inv_gb = 1 / (gamma - beta) if gamma != beta else np.nan
+
+    # switching point (u0_, s0_) at t_, as `unspliced` and `spliced`
+    expu_, exps_ = np.exp(-beta * t_), np.exp(-gamma * t_)
+    u0_ = 0 * expu_ + alpha / beta * (1 - expu_)
+    c_ = (alpha - 0 * beta) * inv_gb
+    s0_ = 0 * exps_ + alpha / gamma * (1 - exps_) + c_ * (exps_ - expu_)
+
+    distx = np.empty(len(t))
+    for i in range(len(t)):
+        o = 1 if t[i] < t_cast else 0
+        tau = t[i] * o + (t[i] - t_cast) * (1 - o)
+        u0, s0 = 0 * o + u0_ * (1 - o), 0 * o + s0_ * (1 - o)
+        alpha_i = alpha * o + 0 * (1 - o)
+
+        expu, exps = np.exp(-beta * tau), np.exp(-gamma * tau)
+        expus = (alpha_i - u0 * beta) * inv_gb * (exps - expu)
+        ut = u0 * expu + alpha_i / beta * (1 - expu)
+        st = s0 * exps + alpha_i / gamma * (1 - exps) + expus
+
+        udiff = (ut - u[i]) / std_u * scaling
+        sdiff = (st - s[i]) / std_s
+        distx[i] = udiff ** 2 + sdiff ** 2
+    return distx
+
+
 def adjust_increments(tau, tau_=None):
     tau_new = np.array(tau)
     tau_ord = np.sort(tau_new)
@@ -177,6 +372,15 @@ def tau_inv(u, s=None, u0=None, s0=None, alpha=None, beta=None, gamma=None):
     return tau
 
 
+@njit(cache=True, nogil=True)
+def project_tau(u, s, ut, st, tpoints):
+    """Time points of the trajectory (ut, st) closest to each observation (u, s)."""
+    tau = np.zeros(len(u))
+    for i in range(len(u)):
+        tau[i] = tpoints[np.argmin((ut - u[i]) ** 2 + (st - s[i]) ** 2)]
+    return tau
+
+
 def assign_tau(
     u, s, alpha, beta, gamma, t_=None, u0_=None, s0_=None, assignment_mode=None
 ):
@@ -194,11 +398,9 @@ def assign_tau(
         xt_ = np.vstack(mRNA(tpoints_, u0_, s0_, 0, beta, gamma)).T
 
         # assign time points (oth. projection onto 'on' and 'off' curve)
-        tau, tau_ = np.zeros(len(u)), np.zeros(len(u))
-        for i, xi in enumerate(x_obs):
-            diffx, diffx_ = np.sum((xt - xi) ** 2, 1), np.sum((xt_ - xi) ** 2, 1)
-            tau[i] = tpoints[np.argmin(diffx)]
-            tau_[i] = tpoints_[np.argmin(diffx_)]
+        u, s = x_obs[:, 0], x_obs[:, 1]
+        tau = project_tau(u, s, xt[:, 0], xt[:, 1], tpoints)
+        tau_ = project_tau(u, s, xt_[:, 0], xt_[:, 1], tpoints_)
     else:
         tau = tau_inv(u, s, 0, 0, alpha, beta, gamma)
         tau = np.clip(tau, 0, t_)
@@ -593,6 +795,13 @@ def compute_divergence(
     return res
 
 
+def get_cluster_masks(clusters):
+    """Boolean mask of the cells in each category, keyed by category."""
+    clusters = pd.Categorical(clusters)
+    codes = clusters.codes
+    return {cat: codes == i for i, cat in enumerate(clusters.categories)}
+
+
 def assign_timepoints(**kwargs):
     return compute_divergence(**kwargs, mode="assign_timepoints")
 
@@ -659,6 +868,25 @@ def curve_dists(
 
 
 class BaseDynamics:
+    # instantiated per gene, hence attributes are stored in slots instead of a dict
+    # (subclasses such as `DynamicsRecovery` keep a dict for any further attributes)
+    # fmt: off
+    __slots__ = (
+        "gene", "u", "s", "use_raw", "u0", "s0", "perc", "recoverable",
+        "alpha", "beta", "gamma", "scaling", "t_", "alpha_", "u0_", "s0_",
+        "weights", "weights_outer", "weights_upper", "t", "tau", "o",
+        "tau_", "likelihood", "loss", "varx", "std_u", "std_s",
+        "_pars_buffer", "_n_pars",
+        "steady_u", "steady_s", "pval_steady", "steady_state_ratio",
+        "max_iter", "simplex_kwargs", "early_stopping", "refit_time",
+        "assignment_mode", "steady_state_prior", "fit_scaling",
+        "fit_steady_states", "fit_connected_states", "connectivities",
+        "high_pars_resolution", "init_vals", "_precomp", "m",
+        "clusters", "cats", "orth_beta", "diff_kinetics", "pval_kinetics",
+        "pvals_kinetics", "cluster_masks",
+    )
+    # fmt: on
+
     def __init__(
         self,
         adata,
@@ -676,18 +904,24 @@ class BaseDynamics:
         high_pars_resolution=False,
         steady_state_prior=None,
         init_vals=None,
+        optimizer="Nelder-Mead",
+        early_stopping=None,
+        dtype=None,
     ):
         self.s, self.u, self.use_raw = None, None, None
 
-        _layers = adata[:, gene].layers
         self.gene = gene
-        self.use_raw = use_raw or "Ms" not in _layers.keys()
+        self.use_raw = use_raw
 
         # extract actual data
         if u is None or s is None:
+            _layers = adata[:, gene].layers
+            self.use_raw = use_raw or "Ms" not in _layers.keys()
             u = _layers["unspliced"] if self.use_raw else _layers["Mu"]
             s = _layers["spliced"] if self.use_raw else _layers["Ms"]
         self.s, self.u = make_dense(s), make_dense(u)
+        if dtype is not None:  # e.g. float32 to halve the memory traffic of fitting
+            self.s, self.u = self.s.astype(dtype), self.u.astype(dtype)
 
         # Basal transcription
         if fit_basal_transcription:
@@ -703,14 +937,17 @@ class BaseDynamics:
         self.weights_outer, self.weights_upper = None, None
         self.t, self.tau, self.o, self.tau_ = None, None, None, None
         self.likelihood, self.loss, self.pars = None, None, None
+        self._precomp = {}
 
         self.max_iter = max_iter
         # partition to total of 5 fitting procedures
         # (t_ and alpha, scaling, rates, t_, all together)
         self.simplex_kwargs = {
-            "method": "Nelder-Mead",
+            "method": optimizer,
             "options": {"maxiter": int(self.max_iter / 5)},
         }
+        # patience (in iterations) to stop each fitting procedure at a plateau
+        self.early_stopping = early_stopping
 
         self.perc = perc
         self.recoverable = True
@@ -739,8 +976,33 @@ class BaseDynamics:
 
         # for differential kinetic test
         self.clusters, self.cats, self.varx, self.orth_beta = None, None, None, None
+        self.cluster_masks = None
         self.diff_kinetics, self.pval_kinetics, self.pvals_kinetics = None, None, None
 
+    @property
+    def pars(self):
+        """Parameters (alpha, beta, gamma, t_, scaling), one column per update."""
+        return (
+            None if self._pars_buffer is None else self._pars_buffer[:, : self._n_pars]
+        )
+
+    @pars.setter
+    def pars(self, pars):
+        self._pars_buffer, self._n_pars = None, 0
+        if pars is not None:
+            self._n_pars = np.shape(pars)[1]
+            self._pars_buffer = np.empty((len(pars), max(64, self._n_pars)))
+            self._pars_buffer[:, : self._n_pars] = pars
+
+    def append_pars(self, pars):
+        """Append a column of parameters, growing the buffer geometrically."""
+        if self._n_pars == self._pars_buffer.shape[1]:
+            buffer = np.empty((len(self._pars_buffer), 2 * self._n_pars))
+            buffer[:, : self._n_pars] = self._pars_buffer
+            self._pars_buffer = buffer
+        self._pars_buffer[:, self._n_pars] = np.ravel(pars)
+        self._n_pars += 1
+
     def initialize_weights(self, weighted=True):
         nonzero_s = np.ravel(self.s > 0)
         nonzero_u = np.ravel(self.u > 0)
@@ -750,12 +1012,8 @@ class BaseDynamics:
 
         if self.recoverable:
             if weighted:
-                ub_s = np.percentile(self.s[weights], self.perc)
-                ub_u = np.percentile(self.u[weights], self.perc)
-                if ub_s > 0:
-                    weights &= np.ravel(self.s <= ub_s)
-                if ub_u > 0:
-                    weights &= np.ravel(self.u <= ub_u)
+                u, s = np.ravel(self.u)[:, None], np.ravel(self.s)[:, None]
+                weights = compute_weights(u, s, self.perc)[:, 0]
 
             self.weights = weights
             u, s = self.u[weights], self.s[weights]
@@ -785,8 +1043,8 @@ class BaseDynamics:
 
         self.alpha_ = 0
         self.u0_, self.s0_ = mRNA(self.t_, 0, 0, self.alpha, self.beta, self.gamma)
-        self.pars = [self.alpha, self.beta, self.gamma, self.t_, self.scaling]
-        self.pars = np.array(self.pars)[:, None]
+        pars = [self.alpha, self.beta, self.gamma, self.t_, self.scaling]
+        self.pars = np.array(pars)[:, None]
 
         lt = "latent_time"
         t = adata.obs[lt] if lt in adata.obs.keys() else adata.layers["fit_t"][:, idx]
@@ -797,7 +1055,8 @@ class BaseDynamics:
             tkey = self.refit_time
             self.t = adata.obs[tkey].values if isinstance(tkey, str) else tkey
             self.refit_time = False
-            steady_states = t == self.t_
+            # compared in the dtype of the (stored) times t
+            steady_states = t == np.asarray(t).dtype.type(self.t_)
             if np.any(steady_states):
                 self.t_ = np.mean(self.t[steady_states])
             self.t, self.tau, self.o = self.get_time_assignment(t=self.t)
@@ -830,6 +1089,36 @@ class BaseDynamics:
             u, s = u[weights], s[weights]
         return u, s
 
+    def precompute(self, t=None, refit_time=None, weighted=True, **kwargs):
+        """Cache parts of the mse that stay fixed while minimizing over parameters.
+
+        The weighted reads are invariant unless weights per cluster are given,
+        the time assignment if it is not refitted.
+        """
+        precomp = {}
+        if weighted is True and kwargs.get("weights_cluster") is None:
+            w = self.get_weights(weighted=True)
+            precomp["u"], precomp["s"] = self.u[w], self.s[w]
+            refit_time = self.refit_time if refit_time is None else refit_time
+            if t is None and not refit_time and self.t is not None:
+                precomp["t"] = self.t, self.t[w]
+        return precomp
+
+    def get_precomputed(self, scaling=None, t=None, weighted=True, **kwargs):
+        """Weighted reads and time assignment from `precompute` (or None each)."""
+        precomp = self._precomp
+        if (
+            not precomp
+            or weighted is not True
+            or kwargs.get("weights_cluster") is not None
+        ):
+            return None, None, None
+        scaling = self.scaling if scaling is None else scaling
+        u, s = precomp["u"] / scaling, precomp["s"]
+        _t = precomp.get("t")
+        t = _t[1] if t is None and _t is not None and _t[0] is self.t else None
+        return u, s, t
+
     def get_vars(
         self,
         alpha=None,
@@ -1004,8 +1293,127 @@ class BaseDynamics:
     def get_se(self, **kwargs):
         return np.sum(self.get_distx(**kwargs))
 
-    def get_mse(self, **kwargs):
-        return np.mean(self.get_distx(**kwargs))
+    def get_mse(
+        self,
+        t=None,
+        t_=None,
+        alpha=None,
+        beta=None,
+        gamma=None,
+        scaling=None,
+        u0_=None,
+        s0_=None,
+        refit_time=None,
+        weighted=True,
+        weights_cluster=None,
+        noise_model="normal",
+        regularize=True,
+        reg=None,
+    ):
+        weight_args = dict(weighted=weighted, weights_cluster=weights_cluster)
+        if noise_model != "normal" or reg is not None:
+            kwargs = dict(t=t, t_=t_, alpha=alpha, beta=beta, gamma=gamma)
+            kwargs.update(dict(scaling=scaling, u0_=u0_, s0_=s0_, reg=reg))
+            kwargs.update(dict(refit_time=refit_time, **weight_args))
+            return np.mean(self.get_distx(noise_model, regularize, **kwargs))
+
+        u, s, t_w = self.get_precomputed(scaling, t, **weight_args)
+        if u is None:
+            u, s = self.get_reads(scaling, **weight_args)
+        alpha, beta, gamma, scaling, t_ = self.get_vars(
+            alpha, beta, gamma, scaling, t_, u0_, s0_
+        )
+        if t_w is None or refit_time:
+            t, tau, o = self.get_time_assignment(
+                alpha, beta, gamma, scaling, t_, u0_, s0_, t, refit_time, **weight_args
+            )
+        else:
+            t = t_w
+
+        t = np.asarray(t)
+        args = (t_, alpha, beta, gamma, scaling, self.std_u, self.std_s)
+        args = tuple(float(arg) for arg in args)
+        t_cast = t.dtype.type(args[0]) if t.dtype.kind == "f" else args[0]
+        distx = distx_kernel(t, u, s, args[0], t_cast, *args[1:])
+        if regularize and self.steady_state_ratio is not None:
+            distx += ((gamma / beta - self.steady_state_ratio) * s / self.std_s) ** 2
+        return np.mean(distx)
+
+    def get_residuals_and_jac(
+        self,
+        t=None,
+        t_=None,
+        alpha=None,
+        beta=None,
+        gamma=None,
+        scaling=None,
+        u0_=None,
+        s0_=None,
+        refit_time=None,
+        weighted=True,
+        weights_cluster=None,
+    ):
+        """Stacked residuals (unspliced, spliced and steady-state regularization)
+        and their Jacobian w.r.t. (alpha, beta, gamma, t_, scaling).
+
+        The time assignment is computed for the given parameters and then
+        held fixed, such that the Jacobian is obtained in closed form from the
+        analytical solution of the splicing kinetics.
+        """
+        weight_args = dict(weighted=weighted, weights_cluster=weights_cluster)
+        u, s, t_w = self.get_precomputed(scaling, t, **weight_args)
+        if u is None:
+            u, s = self.get_reads(scaling, **weight_args)
+
+        alpha, beta, gamma, scaling, t_ = self.get_vars(
+            alpha, beta, gamma, scaling, t_, u0_, s0_
+        )
+        if t_w is None or refit_time:
+            t, tau, o = self.get_time_assignment(
+                alpha, beta, gamma, scaling, t_, u0_, s0_, t, refit_time, **weight_args
+            )
+        else:
+            t = t_w
+
+        on = np.array(t < t_, dtype=int)
+        off = 1 - on
+        tau, alpha_, u0, s0 = vectorize(t, t_, alpha, beta, gamma)
+        ut, st = mRNA(tau, u0, s0, alpha_, beta, gamma)
+
+        udiff = np.array(ut - u) / self.std_u * scaling
+        sdiff = np.array(st - s) / self.std_s
+
+        # partial derivatives w.r.t. (alpha, beta, gamma, t_), where repressive
+        # cells depend on alpha, beta, gamma, t_ via the switching point (u0_, s0_)
+        du0_, ds0_ = mRNA_grad(t_, 0, 0, alpha, beta, gamma)
+        du0_, ds0_ = du0_[[3, 4, 5, 0]][:, None], ds0_[[3, 4, 5, 0]][:, None]
+        grads = []
+        for d in mRNA_grad(tau, u0, s0, alpha_, beta, gamma):
+            d_pars = np.array([d[3] * on, d[4], d[5], -d[0] * off])
+            d_pars += off * (d[1] * du0_ + d[2] * ds0_)
+            grads.append(d_pars)
+        du, ds = grads
+
+        res, jac = [udiff, sdiff], [np.vstack([du * scaling, ut]) / self.std_u]
+        jac.append(np.vstack([ds, np.zeros_like(st)]) / self.std_s)
+
+        if self.steady_state_ratio is not None:
+            res.append((gamma / beta - self.steady_state_ratio) * s / self.std_s)
+            dreg = np.zeros_like(jac[-1])
+            dreg[1], dreg[2] = (
+                -gamma / beta ** 2 * s / self.std_s,
+                s / beta / self.std_s,
+            )
+            jac.append(dreg)
+
+        return np.concatenate(res), np.hstack(jac).T
+
+    def get_mse_and_grad(self, **kwargs):
+        """Mean squared error and its gradient w.r.t. (alpha, beta, gamma, t_, scaling),
+        see `get_residuals_and_jac`."""
+        res, jac = self.get_residuals_and_jac(**kwargs)
+        n_obs = len(res) // (2 if self.steady_state_ratio is None else 3)
+        return res.dot(res) / n_obs, 2 * jac.T.dot(res) / n_obs
 
     def get_loss(
         self,
@@ -1509,14 +1917,17 @@ class BaseDynamics:
         return ax
 
     # for differential kinetic test
-    def initialize_diff_kinetics(self, clusters):
+    def initialize_diff_kinetics(self, clusters, cluster_masks=None):
         # after fitting dyn. model
         if self.varx is None:
             self.varx = self.get_variance()
         self.initialize_weights(weighted=False)
         self.steady_state_ratio = None
         self.clusters = clusters
-        self.cats = pd.Categorical(clusters).categories
+        if cluster_masks is None:
+            cluster_masks = get_cluster_masks(clusters)
+        self.cluster_masks = cluster_masks
+        self.cats = pd.Index(cluster_masks.keys())
         self.weights_outer = np.array(self.weights) & self.get_divergence(
             mode="outside_of_trajectory"
         )
@@ -1593,7 +2004,7 @@ class BaseDynamics:
             self.initialize_diff_kinetics(clusters)
         mse = np.array(
             [
-                self.get_mse(weights_cluster=self.clusters == c, weighted=weighted)
+                self.get_mse(weights_cluster=self.cluster_masks[c], weighted=weighted)
                 for c in self.cats
             ]
         )
@@ -1606,7 +2017,7 @@ class BaseDynamics:
                 else self.weights
             )
             mse[
-                np.array([np.sum(w & (self.clusters == c)) for c in self.cats])
+                np.array([np.sum(w & self.cluster_masks[c]) for c in self.cats])
                 < min_cells
             ] = 0
         return mse
@@ -1617,11 +2028,11 @@ class BaseDynamics:
         pvals = np.array(
             [
                 self.get_pval_diff_kinetics(
-                    weights_cluster=self.clusters == c, orth_beta=orth_beta, **kwargs
+                    weights_cluster=self.cluster_masks[c], orth_beta=orth_beta, **kwargs
                 )
                 if model is None
                 else self.get_pval(
-                    model=model, weights_cluster=self.clusters == c, **kwargs
+                    model=model, weights_cluster=self.cluster_masks[c], **kwargs
                 )
                 for c in self.cats
             ]
@@ -1629,13 +2040,13 @@ class BaseDynamics:
         return pvals
 
     def differential_kinetic_test(
-        self, clusters, as_df=None, min_cells=10, weighted="outer"
+        self, clusters, as_df=None, min_cells=10, weighted="outer", cluster_masks=None
     ):
         # after fitting dyn. model
-        self.initialize_diff_kinetics(clusters)
+        self.initialize_diff_kinetics(clusters, cluster_masks=cluster_masks)
         mse = self.get_cluster_mse(weighted=weighted, min_cells=min_cells)
 
-        weights_cluster = self.clusters == self.cats[np.argmax(mse)]
+        weights_cluster = self.cluster_masks[self.cats[np.argmax(mse)]]
         self.orth_beta = self.get_orth_fit(
             weights_cluster=weights_cluster, weighted=False
         )  # include inner vals
@@ -1647,7 +2058,7 @@ class BaseDynamics:
             weighted = "upper"
             mse = self.get_cluster_mse(weighted=weighted, min_cells=min_cells)
             self.orth_beta = self.get_orth_fit(
-                weights_cluster=self.clusters == self.cats[np.argmax(mse)]
+                weights_cluster=self.cluster_masks[self.cats[np.argmax(mse)]]
             )
 
         self.pvals_kinetics = self.get_cluster_pvals(
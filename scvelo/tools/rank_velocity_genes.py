@@ -319,6 +319,7 @@ def rank_velocity_genes(
         tmp_filter &= l > min_likelihood
 
     X = adata[:, tmp_filter].layers[vkey]
+    var_names = adata.var_names[tmp_filter].to_numpy()
     groups, groups_masks = select_groups(adata, key=groupby)
 
     n_groups = groups_masks.shape[0]
@@ -346,7 +347,7 @@ def rank_velocity_genes(
         idx = np.argpartition(scores, -n_genes)[-n_genes:]
         idx = idx[np.argsort(scores[idx])[::-1]]
 
-        rankings_gene_names.append(adata[:, tmp_filter].var_names[idx].values)
+        rankings_gene_names.append(var_names[idx])
         rankings_gene_scores.append(scores[idx])
 
     rankings_gene_names = np.array([list(n) for n in rankings_gene_names])
@@ -1,9 +1,23 @@
 import numpy as np
+import pandas as pd
+import pytest
 from scipy.integrate import odeint
 
 from scvelo.tools.dynamical_model_utils import mRNA
 
 
+@pytest.fixture(scope="module")
+def adata_preprocessed():
+    """Preprocessed data, created in the test process only, not when the test
+    module is imported by spawned worker processes."""
+    import scvelo as scv
+
+    adata = scv.datasets.simulation(random_seed=0, n_vars=6, n_obs=200)
+    scv.pp.filter_and_normalize(adata)
+    scv.pp.moments(adata)
+    return adata
+
+
 def mRNA_rhs(y, t, alpha, beta, gamma):
     """Right-hand side of the mRNA splicing ODE."""
     u, s = y
@@ -38,3 +52,585 @@ def test_analytical_solution():
 
     # compare
     assert np.allclose([u_ana, s_ana], [u_num, s_num])
+
+
+def test_analytical_gradient():
+    """
+    Test whether the partial derivatives of the analytical solution are close to
+    finite differences.
+    """
+    from scvelo.tools.dynamical_model_utils import mRNA_grad
+
+    x = np.array([0.5, 1, 0.2, 0.5, 0.4, 0.3])  # tau, u0, s0, alpha, beta, gamma
+    du, ds = mRNA_grad(*x)
+
+    eps = 1e-6
+    for i in range(len(x)):
+        dx = np.zeros(len(x))
+        dx[i] = eps
+        u_plus, s_plus = mRNA(*(x + dx))
+        u_minus, s_minus = mRNA(*(x - dx))
+        assert np.isclose(du[i], (u_plus - u_minus) / (2 * eps))
+        assert np.isclose(ds[i], (s_plus - s_minus) / (2 * eps))
+
+
+def test_mse_kernel(adata_preprocessed):
+    """
+    Test whether the fused mse equals the mean of the distances from `get_distx`,
+    including degenerate rates (gamma == beta) and extreme switching times.
+    """
+    from scvelo.tools.dynamical_model import DynamicsRecovery
+
+    adata = adata_preprocessed
+
+    dm = DynamicsRecovery(adata, adata.var_names[0], max_iter=2)
+    dm.fit()
+
+    pars = [
+        {},
+        {"gamma": dm.beta},
+        {"t_": -50.0},
+        {"t_": 1e3},
+        {"beta": 20.0, "t_": -50.0},
+        {"gamma": 30.0, "t_": -50.0},
+    ]
+    for steady_state_ratio in [None, 0.3]:
+        dm.steady_state_ratio = steady_state_ratio
+        for kwargs in pars:
+            mse, mse_distx = dm.get_mse(**kwargs), np.mean(dm.get_distx(**kwargs))
+            assert np.isclose(mse, mse_distx, rtol=1e-12, equal_nan=True)
+            assert np.isnan(mse) == np.isnan(mse_distx)
+    assert np.isnan(dm.get_mse(gamma=dm.beta))
+
+
+def test_percentile():
+    """
+    Test whether the vectorized percentile equals `np.percentile` of each column,
+    over all or the masked entries, for dense and sparse inputs, including ties
+    and all-zero columns.
+    """
+    from scipy.sparse import csr_matrix
+    from scvelo.tools.dynamical_model_utils import percentile
+
+    rng = np.random.default_rng(0)
+    X = rng.gamma(2, size=(101, 6))
+    X[rng.random(X.shape) < 0.6] = 0
+    X[:, [1, 4]] = 0  # all-zero columns
+    X[:, 2] = np.where(np.arange(101) == 7, 3.0, 0)  # a single nonzero entry
+    X[:20, 5] = 1.5  # ties
+
+    for dtype in [np.float32, np.float64]:
+        X_dense = X.astype(dtype)
+        mask = X_dense > 0
+        for q in [0, 50, 98, 99, 100]:
+            ref = np.percentile(X_dense, q, axis=0)
+            ref_masked = [
+                np.percentile(x[m], q) if np.any(m) else np.nan
+                for x, m in zip(X_dense.T, mask.T)
+            ]
+            for Y in [X_dense, csr_matrix(X_dense)]:
+                assert np.allclose(percentile(Y, q), ref)
+                perc = percentile(Y, q, mask)
+                assert np.allclose(perc, ref_masked, equal_nan=True)
+
+
+def initialize_gene(u, s, steady_state_prior=None, perc=99):
+    """Weights and initial parameters of a single gene, as computed per gene by
+    `BaseDynamics.initialize_weights` and `DynamicsRecovery.initialize`."""
+    from scvelo.tools.dynamical_model_utils import convolve, linreg
+
+    w = (s > 0) & (u > 0)
+    ub_s, ub_u = np.percentile(s[w], perc), np.percentile(u[w], perc)
+    if ub_s > 0:
+        w &= s <= ub_s
+    if ub_u > 0:
+        w &= u <= ub_u
+    u_w, s_w = u[w], s[w]
+
+    std_u, std_s = np.std(u_w), np.std(s_w)
+    if std_u == 0 or std_s == 0:
+        std_u = std_s = 1
+    scaling = std_u / std_s
+    u_w = u_w / scaling
+
+    weights_s = s_w >= np.percentile(s_w, 98)
+    weights_u = u_w >= np.percentile(u_w, 98)
+    _prior = steady_state_prior
+    weights_g = weights_s if _prior is None else weights_s | _prior[w]
+    gamma = linreg(convolve(u_w, weights_g), convolve(s_w, weights_g)) + 1e-6
+    if gamma < 0.05 / scaling:
+        gamma *= 1.2
+    elif gamma > 1.5 / scaling:
+        gamma /= 1.2
+
+    u_inf, s_inf = u_w[weights_u | weights_s].mean(), s_w[weights_s].mean()
+    pars = dict(std_u=std_u, std_s=std_s, scaling=scaling, gamma=gamma)
+    return w, dict(pars, u_inf=u_inf, s_inf=s_inf)
+
+
+def test_initialize_batched(adata_preprocessed):
+    """
+    Test whether the weights and initial parameters of all genes at once equal the
+    ones computed per gene, also with a steady-state prior.
+    """
+    from scvelo.tools.dynamical_model import initialize_batched
+    from scvelo.tools.dynamical_model_utils import compute_weights
+
+    adata = adata_preprocessed
+    U, S = adata.layers["Mu"], adata.layers["Ms"]
+    W = compute_weights(U, S, perc=99)
+
+    prior = np.arange(adata.n_obs) % 7 == 0
+    for steady_state_prior in [None, prior]:
+        _prior = None if steady_state_prior is None else steady_state_prior[:, None]
+        pars = initialize_batched(U, S, W, True, _prior)
+        for j in range(adata.n_vars):
+            w, pars_gene = initialize_gene(U[:, j], S[:, j], steady_state_prior)
+            assert np.array_equal(W[:, j], w)
+            for key, val in pars_gene.items():
+                assert np.isclose(pars[key][j], val, rtol=1e-6), key
+
+
+def test_fit_single_rates(adata_preprocessed):
+    """
+    Test whether fitting a single rate by bounded Brent's method does not increase
+    the mse, and finds the minimum over its bounds at least as well as a grid.
+    """
+    from scvelo.tools.dynamical_model import DynamicsRecovery
+
+    adata = adata_preprocessed
+    improved = []
+    for gene in adata.var_names:
+        dm = DynamicsRecovery(adata, gene, max_iter=5)
+        for key in ["alpha", "beta", "gamma"]:
+            val, sight = getattr(dm, key), 0.5
+            bounds = (val * (1 - sight), val * (1 + sight))
+            res = dm.minimize_mse_scalar(key, bounds)
+            assert bounds[0] <= res.x <= bounds[1]
+            grid = np.linspace(*bounds, num=21)
+            assert res.fun <= min(dm.get_mse(**{key: x}) for x in grid) + 1e-10
+
+            mse = dm.get_mse()
+            getattr(dm, f"fit_{key}")(sight=sight)
+            assert dm.get_mse() <= mse
+            improved.append(dm.get_mse() < mse)
+    assert np.any(improved)
+
+
+def test_fit_dtype(adata_preprocessed):
+    """
+    Test whether storing the fitted times at the default `settings.fit_dtype`
+    yields the same parameters and (up to precision) times as float64, also when
+    aligning the stored times again.
+    """
+    import scvelo as scv
+
+    adata = adata_preprocessed
+
+    fit_dtype = scv.settings.fit_dtype
+    results = []
+    for dtype in [fit_dtype, "float64"]:
+        scv.settings.fit_dtype = dtype
+        try:
+            bdata = adata.copy()
+            scv.tl.recover_dynamics(bdata, var_names="all", max_iter=5)
+        finally:
+            scv.settings.fit_dtype = fit_dtype
+        assert bdata.layers["fit_t"].dtype == dtype
+        results.append(bdata)
+
+    bdata, cdata = results
+    keys = ["fit_alpha", "fit_t_", "fit_alignment_scaling", "fit_likelihood"]
+    for key in keys:
+        assert np.array_equal(bdata.var[key], cdata.var[key], equal_nan=True)
+    for key in ["fit_t", "fit_tau", "fit_tau_"]:
+        assert np.allclose(bdata.layers[key], cdata.layers[key], equal_nan=True)
+
+    # aligning again is based on the stored times, i.e. up to their precision
+    scv.tl.align_dynamics(bdata)
+    scv.tl.align_dynamics(cdata)
+    for key in keys:
+        assert np.allclose(bdata.var[key], cdata.var[key], equal_nan=True)
+    for key in ["fit_t", "fit_tau", "fit_tau_"]:
+        assert np.allclose(bdata.layers[key], cdata.layers[key], equal_nan=True)
+
+
+def test_align_reductions_dtype():
+    """
+    Test whether the reductions of `align_dynamics` count the times at the
+    switching point equally when the times are stored at lower precision.
+    """
+    from scvelo.tools.dynamical_model_utils import align_reductions
+
+    rng = np.random.default_rng(0)
+    t_ = np.array([1.1, 2.3, 3.7])
+    T = rng.uniform(0, 5, size=(50, 3))
+    T[::4] = t_  # times at the switching point
+    cols = np.arange(3)
+
+    res = align_reductions(T, t_, t_, cols)
+    T32 = T.astype(np.float32)
+    res32 = align_reductions(T32, t_, t_.astype(np.float32), cols)
+    assert np.array_equal(res[2], res32[2])
+    for x, x32 in zip(res[:2], res32[:2]):
+        assert np.allclose(x, x32)
+
+
+def test_rank_dynamical_genes(adata_preprocessed):
+    """
+    Test whether the ranking reflects the current data, also after modifying it in
+    place, and only stores the ranking tables.
+    """
+    import scvelo as scv
+
+    adata = adata_preprocessed.copy()
+    adata.obs["clusters"] = np.where(np.arange(adata.n_obs) % 2, "a", "b")
+    adata.obs["clusters"] = adata.obs["clusters"].astype("category")
+    scv.tl.recover_dynamics(adata, var_names="all", max_iter=2)
+
+    def rank(adata):
+        scv.tl.rank_dynamical_genes(adata)
+        return adata.uns["rank_dynamical_genes"]["scores"].copy()
+
+    scores = rank(adata)
+    assert set(adata.uns["rank_dynamical_genes"].keys()) == {"names", "scores"}
+    assert np.array_equal(rank(adata), scores)
+
+    adata.layers["Ms"][:] *= 3
+    scores_modified = rank(adata)
+    assert not np.array_equal(scores_modified, scores)
+    assert np.array_equal(rank(adata.copy()), scores_modified)
+
+
+@pytest.mark.parametrize("n_genes", [3, 6, 10])
+def test_rank_dynamical_genes_ties(adata_preprocessed, monkeypatch, n_genes):
+    """
+    Test whether the partial sort of the ranking yields the table of a reversed
+    full sort, including tied and nan scores.
+    """
+    import scvelo as scv
+    from scvelo.tools import dynamical_model_utils
+
+    adata = adata_preprocessed.copy()
+    adata.obs["clusters"] = np.where(np.arange(adata.n_obs) % 2, "a", "b")
+    adata.obs["clusters"] = adata.obs["clusters"].astype("category")
+    adata.var["fit_alpha"] = 1.0
+
+    ll = np.array([[0.5, 0.2, 0.5, np.nan, 0.2, 0.5], [0, 0.1, np.nan, 0.1, 0, 1]])
+    monkeypatch.setattr(dynamical_model_utils, "get_divergence", lambda *a, **kw: ll)
+    scv.tl.rank_dynamical_genes(adata, n_genes=n_genes)
+    ranking = adata.uns["rank_dynamical_genes"]
+
+    idx_sorted = np.argsort(np.nan_to_num(ll), 1, kind="stable")[:, ::-1][:, :n_genes]
+    scores = np.sort(np.nan_to_num(ll), 1)[:, ::-1][:, :n_genes]
+    for i, group in enumerate(["a", "b"]):
+        assert list(ranking["names"][group]) == list(adata.var_names[idx_sorted[i]])
+        assert np.array_equal(ranking["scores"][group], scores[i].astype("float32"))
+
+
+def root_time_reference(t, t_root):
+    """Rooted and switching times, as computed by the original `root_time`."""
+    o = np.array(t >= t_root, dtype=int)
+    t_after = (t - t_root) * o
+    t_origin = np.max(t_after, axis=0)
+    t_before = (t + t_origin) * (1 - o)
+    return t_after + t_before, np.min(t_before, axis=0)
+
+
+def low_confidence_reference(tl, tc, z, min_confidence):
+    """Low-confidence mask, as computed by the original `latent_time`."""
+    tl_conf = (1 - np.abs(tl / np.max(tl) - tc * z / np.max(tl))) ** 2
+    return tl_conf < min_confidence
+
+
+def test_latent_time_kernels(adata_preprocessed, monkeypatch):
+    """
+    Test whether the jitted kernels of `latent_time`, rooting the gene times and
+    masking low-confidence cells, equal their numpy counterparts, for root and
+    end points, and yield the same latent time.
+    """
+    import scvelo as scv
+    from scvelo.tools import dynamical_model_utils as utils
+
+    adata = adata_preprocessed.copy()
+    scv.tl.recover_dynamics(adata, var_names="all", max_iter=5)
+    scv.tl.velocity(adata, mode="dynamical")
+    scv.tl.velocity_graph(adata)
+    scv.tl.terminal_states(adata)
+
+    kernels = {"root_time_kernel": root_time_reference}
+    kernels["low_confidence_mask"] = low_confidence_reference
+    n_calls = dict.fromkeys(kernels, 0)
+
+    def checked(name, kernel, reference):
+        def wrapper(*args):
+            res, ref = kernel(*args), reference(*args)
+            res, ref = (x if isinstance(x, tuple) else (x,) for x in [res, ref])
+            for x, x_ref in zip(res, ref):
+                assert np.allclose(x, x_ref, rtol=1e-6), name
+            n_calls[name] += 1
+            return res if len(res) > 1 else res[0]
+
+        return wrapper
+
+    def latent_time(**kwargs):
+        scv.tl.latent_time(adata, end_key="end_points", **kwargs)
+        return adata.obs["latent_time"].values
+
+    with monkeypatch.context() as m:
+        for name, reference in kernels.items():
+            m.setattr(utils, name, checked(name, getattr(utils, name), reference))
+        tl = latent_time()
+        tl_diff = latent_time(weight_diffusion=0.5)
+    assert n_calls["root_time_kernel"] > 1 and n_calls["low_confidence_mask"] == 2
+
+    with monkeypatch.context() as m:
+        for name, reference in kernels.items():
+            m.setattr(utils, name, reference)
+        # up to the precision of the stored (float32) times
+        assert np.allclose(latent_time(), tl, atol=1e-6)
+        assert np.allclose(latent_time(weight_diffusion=0.5), tl_diff, atol=1e-6)
+
+
+def as_bool_mask_reference(values):
+    """Mask of marked cells, as computed by the original `latent_time`."""
+    mask = np.array(values)
+    mask[pd.isnull(mask)] = 0
+    if np.any([isinstance(x, str) for x in mask]):
+        mask = np.array([isinstance(x, str) for x in mask], dtype=int)
+    return mask.astype(np.float64) > 1 - 1e-3
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["root", None, "root", np.nan, "other"],  # string labels
+        [True, False, True, False, False],  # boolean mask
+        [1, 0, 0, 2, 1],  # integer index
+        [0.9999, 0.5, np.nan, 1.0, 0],  # probabilities
+    ],
+)
+@pytest.mark.parametrize("categorical", [False, True])
+def test_as_bool_mask(values, categorical):
+    """
+    Test whether the cells marked in an `adata.obs` column (e.g. by a root key)
+    equal the ones detected by the original per-cell loops.
+    """
+    from scvelo.tools.dynamical_model import _as_bool_mask
+
+    values = pd.Series(values, dtype="category" if categorical else None)
+    mask = _as_bool_mask(values)
+    assert mask.dtype == bool
+    assert np.array_equal(mask, as_bool_mask_reference(values))
+
+
+def test_early_stopping(adata_preprocessed, monkeypatch):
+    """
+    Test whether early stopping halts the fitting procedures at a plateau of the
+    loss, and whether a halted minimization returns the best parameters.
+    """
+    from scvelo.tools import dynamical_model
+    from scvelo.tools.dynamical_model import DynamicsRecovery
+
+    adata = adata_preprocessed
+    gene = adata.var_names[0]
+
+    # each iteration is recorded with high_pars_resolution
+    kwargs = dict(max_iter=500, high_pars_resolution=True)
+    dm = DynamicsRecovery(adata, gene, **kwargs)
+    dm.fit()
+    dm_es = DynamicsRecovery(adata, gene, early_stopping=3, **kwargs)
+    dm_es.fit()
+    assert len(dm_es.loss) < len(dm.loss)
+    assert dm_es.loss[-1] < 1.1 * dm.loss[-1]
+
+    # halting callbacks raising StopIteration, not handled by scipy<1.11
+    def minimize(fun, x0, **kwargs):
+        fun(np.array(x0) * 1.1)
+        raise StopIteration
+
+    monkeypatch.setattr(dynamical_model, "minimize", minimize)
+    x0 = np.array([dm.t_, dm.alpha])
+    res = dm.minimize_mse(["t_", "alpha"], x0)
+    assert np.allclose(res.x, x0 * 1.1)
+    assert res.fun == dm.get_mse(t_=res.x[0], alpha=res.x[1])
+
+
+def test_optimizers(adata_preprocessed):
+    """
+    Test whether the gradient-based and least squares optimizers minimize the mse
+    about as well as the default downhill simplex (Nelder-Mead).
+    """
+    from scvelo.tools.dynamical_model import DynamicsRecovery
+
+    adata = adata_preprocessed
+
+    optimizers = ["Nelder-Mead", "L-BFGS-B", "trf", "dogbox"]
+    # genes whose mse has no other local minima the optimizers may end up in
+    for gene in adata.var_names[[0, 1, 5]]:
+        losses = []
+        for optimizer in optimizers:
+            dm = DynamicsRecovery(adata, gene, max_iter=100, optimizer=optimizer)
+            dm.fit()
+            assert dm.loss[-1] < dm.loss[0]
+            losses.append(dm.loss[-1])
+        assert np.allclose(losses, losses[0], rtol=0.1)
+
+        # a single fitting procedure, trf and dogbox via `least_squares_mse`
+        keys = ["beta", "scaling"]
+        x0 = np.array([getattr(dm, key) for key in keys]) * 1.3
+        mse0, mses = dm.get_mse(**dict(zip(keys, x0))), []
+        for optimizer in optimizers:
+            dm.simplex_kwargs = {"method": optimizer, "options": {"maxiter": 200}}
+            res = dm.minimize_mse(keys, x0)
+            mses.append(dm.get_mse(**dict(zip(keys, res.x))))
+        assert np.all(np.array(mses) < mse0 / 2)
+        assert np.allclose(mses, mses[0], rtol=0.1)
+
+
+def test_dtype(adata_preprocessed):
+    """
+    Test whether the reads are fitted in the given `dtype`, with the same mse up
+    to its precision.
+    """
+    from scvelo.tools.dynamical_model import DynamicsRecovery
+
+    adata = adata_preprocessed
+    gene = adata.var_names[0]
+
+    dm = DynamicsRecovery(adata, gene, max_iter=10, dtype="float64")
+    dm.fit()
+    dm32 = DynamicsRecovery(adata, gene, max_iter=10, dtype="float32")
+    assert dm.u.dtype == dm.s.dtype == np.float64
+    assert dm32.u.dtype == dm32.s.dtype == np.float32
+
+    pars = dict(alpha=dm.alpha, beta=dm.beta, gamma=dm.gamma, t_=dm.t_)
+    dm32.scaling, dm32.std_u, dm32.std_s = dm.scaling, dm.std_u, dm.std_s
+    assert np.isclose(dm32.get_mse(**pars), dm.get_mse(**pars), rtol=1e-4)
+    assert np.isfinite(dm.likelihood)
+
+
+def fit_dynamics(adata, **kwargs):
+    """Fit the dynamics of all genes of a copy of `adata`."""
+    import scvelo as scv
+
+    adata = adata.copy()
+    scv.tl.recover_dynamics(adata, var_names="all", max_iter=5, **kwargs)
+    return adata
+
+
+def assert_equal_fits(adata, bdata):
+    """Assert that the fitted parameters and times are equal."""
+    keys = [key for key in adata.var.keys() if key.startswith("fit_")]
+    assert keys == [key for key in bdata.var.keys() if key.startswith("fit_")]
+    for key in keys:
+        assert np.array_equal(adata.var[key], bdata.var[key], equal_nan=True), key
+    for key in ["fit_t", "fit_tau", "fit_tau_"]:
+        assert np.array_equal(adata.layers[key], bdata.layers[key], equal_nan=True)
+
+
+def test_joblib_engine(adata_preprocessed):
+    """
+    Test whether fitting in parallel via a joblib backend yields the same result
+    as fitting sequentially.
+    """
+    adata = fit_dynamics(adata_preprocessed)
+    bdata = fit_dynamics(adata_preprocessed, n_procs=2, backend="loky")
+    assert_equal_fits(adata, bdata)
+    # the backend is ignored when fitting sequentially
+    assert_equal_fits(adata, fit_dynamics(adata_preprocessed, backend="loky"))
+
+
+@pytest.fixture
+def spawn():
+    """Start worker processes via spawning, which requires the test module to be
+    safely importable, and does not fork the threads of the test process."""
+    import multiprocessing
+
+    method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method("spawn", force=True)
+    yield
+    multiprocessing.set_start_method(method, force=True)
+
+
+@pytest.mark.parametrize(
+    "sparse, kwargs",
+    [
+        (False, {}),
+        (False, {"fit_connected_states": False}),
+        (False, {"use_raw": True}),
+        (True, {"use_raw": True}),
+    ],
+)
+def test_multiprocessing_engine(spawn, adata_preprocessed, sparse, kwargs):
+    """
+    Test whether fitting in parallel, with the layers and connectivities shared
+    with the workers, yields the same result as fitting sequentially.
+    """
+    from scipy.sparse import csr_matrix
+
+    adata = adata_preprocessed.copy()
+    if sparse:
+        for key in ["spliced", "unspliced"]:
+            adata.layers[key] = csr_matrix(adata.layers[key])
+
+    bdata = fit_dynamics(adata, n_procs=2, **kwargs)
+    assert_equal_fits(fit_dynamics(adata, **kwargs), bdata)
+
+
+@pytest.mark.parametrize("backend", [None, "loky"])
+def test_load_pars_parallel(spawn, adata_preprocessed, backend):
+    """
+    Test whether refitting from the stored parameters in parallel, with only the
+    fitted data of the genes passed on to the workers, yields the same result as
+    refitting sequentially.
+    """
+    adata = fit_dynamics(adata_preprocessed)
+    bdata = fit_dynamics(adata, load_pars=True)
+    assert not np.array_equal(adata.var["fit_alpha"], bdata.var["fit_alpha"])
+
+    kwargs = dict(load_pars=True, n_procs=2, backend=backend)
+    assert_equal_fits(bdata, fit_dynamics(adata, **kwargs))
+
+
+def test_load_pars(adata_preprocessed):
+    """
+    Test whether refitting from the stored parameters (`load_pars=True`) yields
+    the parameters of the original implementation.
+    """
+    import scvelo as scv
+
+    adata = adata_preprocessed.copy()
+    scv.tl.recover_dynamics(adata, var_names="all")
+    alpha = [4.735148, 2.660006, 5.310797, 1.1582, 3.430166, 3.153488]
+    assert np.allclose(adata.var["fit_alpha"], alpha, rtol=1e-5)
+
+    kwargs = dict(load_pars=True, return_model=True)
+    dm = scv.tl.recover_dynamics(adata, var_names="all", **kwargs)
+    alpha = [4.684186, 2.734765, 4.839247, 1.227848, 3.357246, 3.153488]
+    gamma = [0.375325, 0.148203, 0.28752, 0.164959, 0.243707, 0.196258]
+    assert np.allclose(adata.var["fit_alpha"], alpha, rtol=1e-5)
+    assert np.allclose(adata.var["fit_gamma"], gamma, rtol=1e-5)
+
+    # the model of the last gene is returned, and allows further attributes
+    dm.label = "refit"
+    assert dm.label == "refit"
+
+
+def test_time_layers_in_place(adata_preprocessed):
+    """
+    Test whether refitting writes the times to existing float64 layers in place.
+    """
+    import scvelo as scv
+
+    adata = adata_preprocessed.copy()
+    fit_dtype = scv.settings.fit_dtype
+    scv.settings.fit_dtype = "float64"
+    try:
+        scv.tl.recover_dynamics(adata, var_names="all", max_iter=2)
+        layers = {key: adata.layers[key] for key in ["fit_t", "fit_tau", "fit_tau_"]}
+        scv.tl.recover_dynamics(adata, var_names=adata.var_names[:2], max_iter=2)
+    finally:
+        scv.settings.fit_dtype = fit_dtype
+    for key, X in layers.items():
+        assert adata.layers[key] is X